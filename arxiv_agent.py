@@ -1,19 +1,20 @@
-import urllib.request
-import urllib.parse
-import urllib.error
+import asyncio
+import re
 import xml.etree.ElementTree as ET
-from typing import Dict, List, Any
-from base_agent import BaseAgent
+import httpx
+from typing import Dict, List, Any, Optional
+from base_agent import BaseAgent, LLMOverloadedError
+from ttl_cache import TTLCache
 
-class ArxivAgent(BaseAgent):
-    """Agent specialized for searching and processing ArXiv papers."""
-    
-    def __init__(self):
-        super().__init__("ArXiv Agent")
-    
-    def generate_search_query(self, user_question: str, **kwargs) -> str:
-        """Generate ArXiv-specific search query with prefixes."""
-        prompt = f"""
+# Compiled once; _clean_text runs per paper field so the pattern-cache
+# lookup inside re.sub adds up.
+_WS_RE = re.compile(r'\s+')
+
+# Single-pass character substitutions for _clean_text
+_TRANS = str.maketrans({'\n': ' ', '\r': ' ', '"': "'"})
+
+# Static query-generation prompt, formatted per call with just the question
+_ARXIV_QUERY_PROMPT_TPL = """
         You are an expert at creating search queries for the arXiv academic database.
         Transform the user's question into a concise query string using arXiv's syntax.
 
@@ -28,36 +29,94 @@ class ArxivAgent(BaseAgent):
         User Question: "What are the latest advancements in using graph neural networks for drug discovery?"
         Result: ti:"graph neural network" AND abs:"drug discovery"
         """
+
+# Batch variant of the prompt above, keeping the arXiv query syntax
+_ARXIV_BATCH_QUERY_PROMPT_TPL = """
+        You are an expert at creating search queries for the arXiv academic database.
+        For each question below, produce one concise query string using arXiv's syntax.
+
+        - Use prefixes like `ti:` for title, `au:` for author, and `abs:` for abstract.
+        - Combine keywords with `AND`, `OR`. Use quotes for exact phrases.
+        - Focus on the most critical technical terms.
+
+        Questions:
+        {numbered}
+
+        Return ONLY a JSON array of the query strings, in the same order as
+        the questions, with no explanations.
+        """
+
+# Parsed arXiv results keyed by (query, date range, max_results); arXiv
+# metadata barely changes day to day, so repeat searches skip the HTTP
+# call for a full day.
+_SEARCH_CACHE = TTLCache(maxsize=512, ttl=24 * 3600)
+
+# Long-lived pooled sessions: keep-alive skips the TCP handshake on every
+# search, gzip shrinks the Atom XML, and HTTP/2 lets concurrent
+# sub-question searches multiplex one connection.
+_ARXIV_API_URL = 'http://export.arxiv.org/api/query'
+_HTTP = httpx.Client(
+    http2=True,
+    timeout=30,
+    limits=httpx.Limits(max_connections=32),
+    headers={'Accept-Encoding': 'gzip'},
+)
+_ASYNC_HTTP = httpx.AsyncClient(
+    http2=True,
+    timeout=30,
+    limits=httpx.Limits(max_connections=32),
+    headers={'Accept-Encoding': 'gzip'},
+)
+
+class ArxivAgent(BaseAgent):
+    """Agent specialized for searching and processing ArXiv papers."""
+
+    # Fully-qualified Atom tags resolved once; find() with an 'atom:' prefix
+    # re-expands the QName through the namespace dict on every call.
+    _ATOM_NS = 'http://www.w3.org/2005/Atom'
+    _ENTRY_TAG = f'{{{_ATOM_NS}}}entry'
+    _TITLE_TAG = f'{{{_ATOM_NS}}}title'
+    _SUMMARY_TAG = f'{{{_ATOM_NS}}}summary'
+    _ID_TAG = f'{{{_ATOM_NS}}}id'
+    
+    def __init__(self):
+        super().__init__("ArXiv Agent")
+        # In-flight async searches keyed like the cache, so identical
+        # concurrent queries share one fetch instead of fanning out.
+        self._inflight: Dict[Any, asyncio.Future] = {}
+    
+    def generate_search_query(self, user_question: str, **kwargs) -> str:
+        """Generate ArXiv-specific search query with prefixes."""
+        prompt = _ARXIV_QUERY_PROMPT_TPL.format(user_question=user_question)
         
         try:
-            if "gemini" in self.model.lower():
-                response = self.client.models.generate_content(
-                    model=self.model,
-                    contents=prompt
-                )
-                return response.text.strip() if response.text is not None else ""
-            else:
-                response = self.client.generate(
-                    model=self.model,
-                    prompt=prompt
-                )
-                return response['response'] if response['response'] is not None else ""
+            return self._call_with_retry(lambda: self._complete(prompt)).strip()
+        except LLMOverloadedError:
+            raise
         except Exception:
             return super().generate_search_query(user_question, **kwargs)
-    
+
+    def _batch_query_prompt(self, numbered: str) -> str:
+        """ArXiv-syntax prompt for generate_search_queries_batch."""
+        return _ARXIV_BATCH_QUERY_PROMPT_TPL.format(numbered=numbered)
+
     def search(self, query: str, **kwargs) -> List[Dict[str, Any]]:
         """Search ArXiv for papers."""
         max_results = kwargs.get('max_results', 5)
         date_from = kwargs.get('date_from')
         date_to = kwargs.get('date_to')
         
+        cache_key = (query.lower().strip(), date_from, date_to, max_results)
+        cached = _SEARCH_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+
         # Add date filtering if provided
         if date_from and date_to:
             from_formatted = date_from.replace('-', '')
             to_formatted = date_to.replace('-', '')
             query += f" AND submittedDate:[{from_formatted} TO {to_formatted}]"
         
-        base_url = 'http://export.arxiv.org/api/query?'
         params = {
             'search_query': query,
             'sortBy': 'relevance',
@@ -65,50 +124,118 @@ class ArxivAgent(BaseAgent):
             'max_results': max_results
         }
         
-        url = base_url + urllib.parse.urlencode(params)
-        
         try:
-            with urllib.request.urlopen(url) as response:
-                xml_data = response.read().decode('utf-8')
-            return self._parse_arxiv_xml(xml_data)
+            papers: List[Dict[str, Any]] = []
+            parser = ET.XMLPullParser(events=('end',))
+            # Stream the body into the pull parser: entries are parsed as
+            # bytes arrive and freed once read, so peak memory stays flat
+            # and hitting max_results skips the rest of the download.
+            with _HTTP.stream('GET', _ARXIV_API_URL, params=params) as response:
+                response.raise_for_status()
+                for chunk in response.iter_bytes():
+                    parser.feed(chunk)
+                    if self._drain_entries(parser, papers, max_results):
+                        break
+            if papers:
+                _SEARCH_CACHE.set(cache_key, papers)
+            return papers
         except Exception as e:
             print(f"ArXiv search error: {e}")
             return []
     
-    def _parse_arxiv_xml(self, xml_data: str) -> List[Dict[str, Any]]:
-        """Parse ArXiv XML response."""
-        papers = []
+    async def asearch(self, query: str, **kwargs) -> List[Dict[str, Any]]:
+        """Search ArXiv for papers without blocking the event loop."""
+        max_results = kwargs.get('max_results', 5)
+        date_from = kwargs.get('date_from')
+        date_to = kwargs.get('date_to')
+
+        cache_key = (query.lower().strip(), date_from, date_to, max_results)
+        cached = _SEARCH_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Coalesce duplicate concurrent searches onto a single fetch
+        inflight = self._inflight.get(cache_key)
+        if inflight is not None:
+            return await inflight
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            papers = await self._afetch(query, max_results, date_from, date_to)
+            if papers:
+                _SEARCH_CACHE.set(cache_key, papers)
+            future.set_result(papers)
+            return papers
+        finally:
+            self._inflight.pop(cache_key, None)
+            if not future.done():
+                future.set_result([])
+
+    async def _afetch(self, query: str, max_results: int, date_from, date_to) -> List[Dict[str, Any]]:
+        """Perform the actual async arXiv request and parse."""
+        # Add date filtering if provided
+        if date_from and date_to:
+            from_formatted = date_from.replace('-', '')
+            to_formatted = date_to.replace('-', '')
+            query += f" AND submittedDate:[{from_formatted} TO {to_formatted}]"
+
+        params = {
+            'search_query': query,
+            'sortBy': 'relevance',
+            'sortOrder': 'descending',
+            'max_results': max_results
+        }
+
         try:
-            namespace = {'atom': 'http://www.w3.org/2005/Atom'}
-            root = ET.fromstring(xml_data)
-            entries = root.findall('atom:entry', namespace)
-
-            for entry in entries:
-                title_elem = entry.find('atom:title', namespace)
-                summary_elem = entry.find('atom:summary', namespace)
-                link_elem = entry.find('atom:id', namespace)
-                
-                if all(elem is not None and getattr(elem, 'text', None) for elem in [title_elem, summary_elem, link_elem]):
-                    papers.append({
-                        'title': self._clean_text(getattr(title_elem, 'text', "") or ""),
-                        'summary': self._clean_text(getattr(summary_elem, 'text', "") or ""),
-                        'link': (getattr(link_elem, 'text', "") or "").strip(),
-                        'source_type': 'arxiv'
-                    })
+            papers: List[Dict[str, Any]] = []
+            parser = ET.XMLPullParser(events=('end',))
+            async with _ASYNC_HTTP.stream('GET', _ARXIV_API_URL, params=params) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes():
+                    parser.feed(chunk)
+                    if self._drain_entries(parser, papers, max_results):
+                        break
             return papers
         except Exception as e:
-            print(f"XML parsing error: {e}")
+            print(f"ArXiv search error: {e}")
             return []
+
+    def _drain_entries(self, parser: ET.XMLPullParser, papers: List[Dict[str, Any]],
+                       max_results: Optional[int] = None) -> bool:
+        """Consume completed <entry> elements from the pull parser.
+
+        Appends parsed papers and returns True once max_results is reached,
+        so the caller can stop feeding (and downloading) early.
+        """
+        for _, elem in parser.read_events():
+            if elem.tag != self._ENTRY_TAG:
+                continue
+
+            # findtext skips the Element construction/attribute checks that
+            # find(...).text would pay per field
+            title = elem.findtext(self._TITLE_TAG)
+            summary = elem.findtext(self._SUMMARY_TAG)
+            link = elem.findtext(self._ID_TAG)
+
+            if title and summary and link:
+                papers.append({
+                    'title': self._clean_text(title),
+                    'summary': self._clean_text(summary),
+                    'link': link.strip(),
+                    'source_type': 'arxiv'
+                })
+            # Drop the parsed subtree so memory stays flat for large feeds
+            elem.clear()
+            if max_results is not None and len(papers) >= max_results:
+                return True
+        return False
     
     def _clean_text(self, text: str) -> str:
-        """Clean text for JSON safety."""
+        """Clean text for JSON safety in one pass over the string."""
         if not text:
             return ""
-        text = text.replace('\n', ' ').replace('\r', ' ')
-        text = text.replace('"', "'")
-        import re
-        text = re.sub(r'\s+', ' ', text)
-        return text.strip()
+        return _WS_RE.sub(' ', text.translate(_TRANS)).strip()
     
     def process_sources(self, sources: List[Dict[str, Any]], **kwargs) -> List[Dict[str, Any]]:
         """Process ArXiv sources (already clean from XML parsing)."""
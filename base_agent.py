@@ -1,8 +1,194 @@
+import asyncio
 import os
+import random
+import re
+import threading
+import time
+
+import orjson
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from typing import Dict, List, Any, Optional
 from google import genai
 from ollama import Client as OllamaClient
+from ttl_cache import TTLCache
+import llm_cache
+
+# Keyword-extraction fallback pieces, compiled/built once instead of per call
+_WORD_RE = re.compile(r"[A-Za-z0-9']+")
+_STOPWORDS = {"the", "a", "an", "of", "in", "on", "for", "and", "to", "with", "is", "are", "how", "what", "why", "who", "where"}
+
+# Process-wide clients: constructing genai.Client/OllamaClient per agent
+# redoes auth setup and connection-pool initialization, and defeats HTTP
+# keep-alive across requests.
+_GENAI_CLIENT = None
+_OLLAMA_CLIENT = None
+
+
+def _get_genai_client():
+    global _GENAI_CLIENT
+    if _GENAI_CLIENT is None:
+        _GENAI_CLIENT = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+    return _GENAI_CLIENT
+
+
+def _get_ollama_client():
+    global _OLLAMA_CLIENT
+    if _OLLAMA_CLIENT is None:
+        _OLLAMA_CLIENT = OllamaClient(host='http://localhost:11434')
+    return _OLLAMA_CLIENT
+
+
+# Transient provider failures worth retrying; anything else (bad API key,
+# invalid argument) is deterministic and retrying just re-pays the call.
+_TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+_TRANSIENT_NAMES = (
+    'ServiceUnavailable', 'ResourceExhausted', 'TooManyRequests',
+    'InternalServerError', 'DeadlineExceeded', 'ConnectError', 'ReadTimeout',
+)
+
+
+# Cap concurrent outbound LLM calls across all agents in this process.
+# With gather-parallel agents and multiple workers, unbounded fan-out
+# trips provider rate limits and triggers 429 retry storms.
+_LLM_SEM = threading.BoundedSemaphore(int(os.getenv("LLM_MAX_ASYNC", "8")))
+
+# How long a call may wait for a semaphore slot before the process
+# declares itself overloaded. Queueing forever holds request state in
+# memory and hangs clients; failing fast lets them back off cleanly.
+_LLM_ACQUIRE_TIMEOUT = float(os.getenv("LLM_ACQUIRE_TIMEOUT", "10"))
+
+# In-flight LLM call gauge, exposed via llm_inflight() as a load signal.
+_INFLIGHT_LOCK = threading.Lock()
+_LLM_INFLIGHT = 0
+
+
+class LLMOverloadedError(RuntimeError):
+    """Raised when the LLM concurrency gate stays saturated past the acquire timeout."""
+
+
+def llm_inflight() -> int:
+    """Current number of in-flight LLM calls (autoscaling/monitoring signal)."""
+    return _LLM_INFLIGHT
+
+
+def _inflight_add(delta: int) -> None:
+    global _LLM_INFLIGHT
+    with _INFLIGHT_LOCK:
+        _LLM_INFLIGHT += delta
+
+
+# Shared long-lived event loop for sync entry points that drive the async
+# pipelines. asyncio.run builds a fresh loop per call and closes it on
+# return, but pooled async clients (httpx.AsyncClient, the genai aio API)
+# bind their keep-alive connections to the loop they first ran on — the
+# next call then finds those connections pointing at a closed loop and
+# fails. One persistent loop keeps the pools valid across requests.
+_LOOP_LOCK = threading.Lock()
+_BG_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _BG_LOOP
+    with _LOOP_LOCK:
+        if _BG_LOOP is None or _BG_LOOP.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="agent-async-loop", daemon=True).start()
+            _BG_LOOP = loop
+        return _BG_LOOP
+
+
+def run_coroutine(coro):
+    """Run `coro` to completion on the shared background loop and return its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+
+# Prompt templates hoisted to module scope so each call only formats the
+# dynamic fields instead of rebuilding the whole string.
+_QUERY_PROMPT_TPL = """
+        Transform the user's question into a concise search query.
+        Focus on the most critical technical terms and concepts.
+
+        User Question: "{user_question}"
+
+        Return ONLY the search query string, no explanations.
+        """
+
+_BATCH_QUERY_PROMPT_TPL = """
+        For each question below, produce one concise search query focusing on
+        the most critical technical terms and concepts.
+
+        Questions:
+        {numbered}
+
+        Return ONLY a JSON array of the query strings, in the same order as
+        the questions, with no explanations.
+        """
+
+
+# Rough chars-per-token ratio for English text; close enough for budgeting
+# prompt sizes without shipping a tokenizer dependency.
+_CHARS_PER_TOKEN = 4
+
+
+def truncate_for_prompt(text: str, max_tokens: int) -> str:
+    """
+    Cap text at roughly `max_tokens`, keeping the head and tail.
+
+    Long transcripts and page dumps multiplied by dozens of sources blow
+    the model's context window; the head usually carries the thesis and
+    the tail the conclusions, so both survive the cut.
+    """
+    if not text:
+        return text
+    limit = max_tokens * _CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    head = (limit * 3) // 4
+    tail = limit - head
+    return text[:head] + " ... [truncated] ... " + text[-tail:]
+
+
+def dedup_sources(sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Drop duplicate sources by their stable link/url key, keeping first seen.
+
+    The same paper or video can surface from several agents or sub-question
+    searches; each duplicate re-pays its prompt tokens in synthesis for no
+    information gain.
+    """
+    seen = set()
+    deduped = []
+    for source in sources:
+        key = source.get('link') or source.get('url') or source.get('title')
+        if key and key in seen:
+            continue
+        if key:
+            seen.add(key)
+        deduped.append(source)
+    return deduped
+
+
+@dataclass(slots=True)
+class AgentResult:
+    """
+    Normalized output of a source agent.
+
+    Every agent used to return its own dict shape, so callers had to guess
+    between str-formatting the whole result and calling .get('sources') on
+    it — and guessed wrong in places, stringifying dicts into reports or
+    raising AttributeError on strings. One typed shape removes the guess;
+    slots keep the per-result footprint small.
+    """
+    summary: str
+    sources: List[Dict[str, Any]]
+
+
+def _is_transient_error(exc: Exception) -> bool:
+    code = getattr(exc, 'code', None) or getattr(exc, 'status_code', None)
+    if isinstance(code, int) and code in _TRANSIENT_STATUS:
+        return True
+    return type(exc).__name__ in _TRANSIENT_NAMES
 
 class BaseAgent(ABC):
     """
@@ -10,29 +196,119 @@ class BaseAgent(ABC):
     Provides common functionality and enforces interface consistency.
     """
     
-    def __init__(self, name: str, model: str = "gemma3:4b"):
+    def __init__(self, name: str, model: str = "gemma3:4b", client=None):
         self.name = name
         self.model = model
-        if "gemini" in self.model.lower():
-            self.client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+        if client is not None:
+            self.client = client
+            self._complete = (self._gemini_complete if "gemini" in model.lower()
+                              else self._ollama_complete)
         else:
-            self.client = OllamaClient(
-                host='http://localhost:11434'
-            )
+            self.update_model(model)
 
         if not os.getenv("GOOGLE_API_KEY"):
             raise ValueError("GOOGLE_API_KEY environment variable not set")
-    
+
     def update_model(self, model: str):
-        """Update the model and reinitialize the client accordingly."""
+        """Update the model and point at the matching shared client.
+
+        The provider check runs here, once per model switch, and binds
+        `_complete` so hot-path callers get a plain `self._complete(prompt)`
+        instead of re-testing the model name on every request.
+        """
         self.model = model
         if "gemini" in self.model.lower():
-            self.client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+            self.client = _get_genai_client()
+            self._complete = self._gemini_complete
         else:
-            self.client = OllamaClient(
-                host='http://localhost:11434'
-            )
+            self.client = _get_ollama_client()
+            self._complete = self._ollama_complete
+
+    def _gemini_complete(self, prompt: str) -> str:
+        """Prompt-in/text-out completion against the Gemini client."""
+        response = self.client.models.generate_content(
+            model=self.model,
+            contents=prompt
+        )
+        return response.text if response.text is not None else ""
+
+    def _ollama_complete(self, prompt: str) -> str:
+        """Prompt-in/text-out completion against the Ollama client."""
+        response = self.client.generate(
+            model=self.model,
+            prompt=prompt
+        )
+        return response['response'] if response['response'] is not None else ""
     
+    def _call_with_retry(self, call, retries: int = 2):
+        """Run an LLM call, retrying only transient failures with jittered backoff."""
+        for attempt in range(retries + 1):
+            try:
+                if not _LLM_SEM.acquire(timeout=_LLM_ACQUIRE_TIMEOUT):
+                    raise LLMOverloadedError("LLM concurrency limit saturated")
+                _inflight_add(1)
+                try:
+                    return call()
+                finally:
+                    _inflight_add(-1)
+                    _LLM_SEM.release()
+            except Exception as e:
+                if attempt >= retries or not _is_transient_error(e):
+                    raise
+                time.sleep(2 ** attempt + random.random())
+
+    async def _acall_with_retry(self, call, retries: int = 2):
+        """Async counterpart of _call_with_retry."""
+        for attempt in range(retries + 1):
+            try:
+                # Acquire off-loop so a saturated semaphore doesn't block
+                # the event loop for other requests.
+                if not await asyncio.to_thread(_LLM_SEM.acquire, True, _LLM_ACQUIRE_TIMEOUT):
+                    raise LLMOverloadedError("LLM concurrency limit saturated")
+                _inflight_add(1)
+                try:
+                    return await call()
+                finally:
+                    _inflight_add(-1)
+                    _LLM_SEM.release()
+            except Exception as e:
+                if attempt >= retries or not _is_transient_error(e):
+                    raise
+                await asyncio.sleep(2 ** attempt + random.random())
+
+    def _stream_with_gate(self, make_stream):
+        """Stream-shaped counterpart of _call_with_retry.
+
+        Holds a semaphore slot for the whole life of the stream, so
+        streamed calls count against the same concurrency cap as regular
+        ones. Retrying doesn't apply once tokens have been yielded
+        downstream, so failures mid-stream surface to the caller.
+        """
+        if not _LLM_SEM.acquire(timeout=_LLM_ACQUIRE_TIMEOUT):
+            raise LLMOverloadedError("LLM concurrency limit saturated")
+        _inflight_add(1)
+        try:
+            yield from make_stream()
+        finally:
+            _inflight_add(-1)
+            _LLM_SEM.release()
+
+    async def _astream_with_gate(self, make_stream):
+        """Async counterpart of _stream_with_gate.
+
+        `make_stream` must return an awaitable resolving to an async
+        iterator, matching the genai aio streaming API.
+        """
+        if not await asyncio.to_thread(_LLM_SEM.acquire, True, _LLM_ACQUIRE_TIMEOUT):
+            raise LLMOverloadedError("LLM concurrency limit saturated")
+        _inflight_add(1)
+        try:
+            async for chunk in await make_stream():
+                yield chunk
+        finally:
+            _inflight_add(-1)
+            _LLM_SEM.release()
+
     @abstractmethod
     def search(self, query: str, **kwargs) -> List[Dict[str, Any]]:
         """Search for relevant sources based on the query."""
@@ -42,60 +318,194 @@ class BaseAgent(ABC):
     def process_sources(self, sources: List[Dict[str, Any]], **kwargs) -> List[Dict[str, Any]]:
         """Process and enhance the sources (e.g., fetch transcripts, clean data)."""
         pass
-    
+
+    async def asearch(self, query: str, **kwargs) -> List[Dict[str, Any]]:
+        """Async search. Subclasses with a native async path should override;
+        the default offloads the sync implementation to a thread."""
+        return await asyncio.to_thread(self.search, query, **kwargs)
+
+    async def aprocess_sources(self, sources: List[Dict[str, Any]], **kwargs) -> List[Dict[str, Any]]:
+        """Async source processing. Defaults to running the sync version in a thread."""
+        return await asyncio.to_thread(self.process_sources, sources, **kwargs)
+
     def generate_search_query(self, user_question: str, **kwargs) -> str:
         """Generate optimized search query from user question."""
-        prompt = f"""
-        Transform the user's question into a concise search query.
-        Focus on the most critical technical terms and concepts.
-        
-        User Question: "{user_question}"
-        
-        Return ONLY the search query string, no explanations.
-        """
+        # Exact tier catches verbatim repeats; the fuzzy tier catches the
+        # same question asked in slightly different words.
+        cache_ns = f"query:{self.name}:{self.model}"
+        cache_text = user_question.lower().strip()
+        cached = llm_cache.get(cache_ns, cache_text, fuzzy_text=user_question)
+        if cached is not None:
+            return cached
+
+        prompt = _QUERY_PROMPT_TPL.format(user_question=user_question)
         
         try:
             if "gemini" in self.model.lower():
-                response = self.client.models.generate_content(
+                response = self._call_with_retry(lambda: self.client.models.generate_content(
                     model=self.model,
                     contents=prompt
-                )
-                return response.text.strip() if response.text is not None else ""
+                ))
+                query = response.text.strip() if response.text is not None else ""
             else:
-                response = self.client.generate(
+                response = self._call_with_retry(lambda: self.client.generate(
                     model=self.model,
                     prompt=prompt
-                )
-                return response['response'] if response['response'] is not None else ""
+                ))
+                query = response['response'] if response['response'] is not None else ""
+
+            llm_cache.put(cache_ns, cache_text, query, fuzzy_text=user_question)
+            return query
 
+        except LLMOverloadedError:
+            # Saturation must reach the route's 503 handler; degrading to
+            # the keyword fallback would hide it behind a 200.
+            raise
         except Exception as e:
-            # Fallback to simple keyword extraction
-            import re
-            words = re.findall(r"[A-Za-z0-9']+", user_question.lower())
-            stopwords = {"the", "a", "an", "of", "in", "on", "for", "and", "to", "with", "is", "are", "how", "what", "why", "who", "where"}
-            words = [w for w in words if w not in stopwords and len(w) > 2]
-            return " ".join(words[:6])
-    
-    def run(self, user_question: str, **kwargs) -> Dict[str, Any]:
+            return self._fallback_search_query(user_question)
+
+    async def agenerate_search_query(self, user_question: str, **kwargs) -> str:
+        """Async variant of generate_search_query using the non-blocking client APIs."""
+        cache_ns = f"query:{self.name}:{self.model}"
+        cache_text = user_question.lower().strip()
+        cached = llm_cache.get(cache_ns, cache_text, fuzzy_text=user_question)
+        if cached is not None:
+            return cached
+
+        prompt = _QUERY_PROMPT_TPL.format(user_question=user_question)
+
+        try:
+            if "gemini" in self.model.lower():
+                response = await self._acall_with_retry(lambda: self.client.aio.models.generate_content(
+                    model=self.model,
+                    contents=prompt
+                ))
+                query = response.text.strip() if response.text is not None else ""
+            else:
+                response = await self._acall_with_retry(lambda: asyncio.to_thread(
+                    self.client.generate,
+                    model=self.model,
+                    prompt=prompt
+                ))
+                query = response['response'] if response['response'] is not None else ""
+            llm_cache.put(cache_ns, cache_text, query, fuzzy_text=user_question)
+            return query
+
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            return self._fallback_search_query(user_question)
+
+    def _batch_query_prompt(self, numbered: str) -> str:
+        """Prompt for batch query generation; subclasses with their own
+        query syntax override this alongside generate_search_query."""
+        return _BATCH_QUERY_PROMPT_TPL.format(numbered=numbered)
+
+    def generate_search_queries_batch(self, questions: List[str], **kwargs) -> List[str]:
+        """
+        Generate one optimized search query per question in a single LLM call.
+
+        Collapsing the per-question transformations into one request saves a
+        full network round-trip for every question beyond the first. Cached
+        questions are resolved up front so only the misses go to the model,
+        and results land in the same cache generate_search_query reads.
+        """
+        if not questions:
+            return []
+        if len(questions) == 1:
+            return [self.generate_search_query(questions[0], **kwargs)]
+
+        cache_ns = f"query:{self.name}:{self.model}"
+        queries: List[Optional[str]] = [
+            llm_cache.get(cache_ns, q.lower().strip(), fuzzy_text=q) for q in questions
+        ]
+        misses = [i for i, q in enumerate(queries) if q is None]
+        if not misses:
+            return queries
+        if len(misses) == 1:
+            queries[misses[0]] = self.generate_search_query(questions[misses[0]], **kwargs)
+            return queries
+
+        numbered = "\n".join(f"{n}. {questions[i]}" for n, i in enumerate(misses, 1))
+        prompt = self._batch_query_prompt(numbered)
+
+        try:
+            response_text = self._call_with_retry(lambda: self._complete(prompt)).strip()
+
+            json_start = response_text.find('[')
+            json_end = response_text.rfind(']') + 1
+            if json_start != -1 and json_end > json_start:
+                batch = orjson.loads(response_text[json_start:json_end])
+                if isinstance(batch, list) and len(batch) == len(misses):
+                    for i, query in zip(misses, batch):
+                        query = str(query).strip()
+                        queries[i] = query
+                        llm_cache.put(cache_ns, questions[i].lower().strip(), query, fuzzy_text=questions[i])
+                    return queries
+            raise ValueError("Batch response did not match the question count")
+        except LLMOverloadedError:
+            raise
+        except Exception:
+            # Fall back to per-question generation if the batch parse fails
+            for i in misses:
+                queries[i] = self.generate_search_query(questions[i], **kwargs)
+            return queries
+
+    def _fallback_search_query(self, user_question: str) -> str:
+        """Simple keyword extraction used when the LLM is unavailable."""
+        words = _WORD_RE.findall(user_question.lower())
+        words = [w for w in words if w not in _STOPWORDS and len(w) > 2]
+        return " ".join(words[:6])
+
+    def _summarize_sources(self, sources: List[Dict[str, Any]]) -> str:
+        """Render sources as a readable list for reports and fallback answers."""
+        if not sources:
+            return f"{self.name} found no sources."
+        return "\n".join(
+            f"- {s.get('title', 'Untitled')} ({s.get('link') or s.get('url', '')})"
+            for s in sources
+        )
+
+    def run(self, user_question: str, **kwargs) -> AgentResult:
         """Main execution method for the agent."""
         print(f"{self.name}: Starting research...")
-        
-        # Generate search query
-        query = self.generate_search_query(user_question, **kwargs)
+
+        # Use the caller's pre-generated query (e.g. from a batched
+        # generation pass) or generate one here
+        query = kwargs.pop('search_query', None) or self.generate_search_query(user_question, **kwargs)
         print(f"{self.name}: Using query: {query}")
-        
+
         # Search for sources
         sources = self.search(query, **kwargs)
         print(f"{self.name}: Found {len(sources)} sources")
-        
+
         # Process sources
         processed_sources = self.process_sources(sources, **kwargs)
         print(f"{self.name}: Processed {len(processed_sources)} sources")
-        
-        return {
-            "agent_name": self.name,
-            "query": query,
-            "user_question": user_question,
-            "sources": processed_sources,
-            "source_count": len(processed_sources)
-        }
\ No newline at end of file
+
+        return AgentResult(
+            summary=self._summarize_sources(processed_sources),
+            sources=processed_sources,
+        )
+
+    async def arun(self, user_question: str, **kwargs) -> AgentResult:
+        """Async execution method so callers can await agents without blocking the event loop."""
+        print(f"{self.name}: Starting research...")
+
+        # Use the caller's pre-generated query (e.g. from a batched
+        # generation pass) or generate one here
+        query = kwargs.pop('search_query', None) or await self.agenerate_search_query(user_question, **kwargs)
+        print(f"{self.name}: Using query: {query}")
+
+        # Search for sources
+        sources = await self.asearch(query, **kwargs)
+        print(f"{self.name}: Found {len(sources)} sources")
+
+        # Process sources
+        processed_sources = await self.aprocess_sources(sources, **kwargs)
+        print(f"{self.name}: Processed {len(processed_sources)} sources")
+
+        return AgentResult(
+            summary=self._summarize_sources(processed_sources),
+            sources=processed_sources,
+        )
\ No newline at end of file
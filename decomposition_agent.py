@@ -1,6 +1,85 @@
-import json
-from typing import List, Dict, Any
-from base_agent import BaseAgent
+import orjson
+import re
+from typing import List, Dict, Any, Optional
+from google.genai import types
+from base_agent import BaseAgent, LLMOverloadedError
+
+# Content-word extraction for sub-question similarity
+_WORD_RE = re.compile(r"[a-z0-9']+")
+_STOPWORDS = {"the", "a", "an", "of", "in", "on", "for", "and", "to", "with", "is", "are", "how", "what", "why", "who", "where", "which"}
+
+
+def _dedupe_sub_questions(sub_questions: List[str]) -> List[str]:
+    """
+    Greedily keep only sub-questions whose content words are sufficiently novel.
+
+    Decomposition often emits semantically overlapping questions ("what is
+    X" vs "define X"), and each one multiplies every downstream API call.
+    Jaccard overlap on content words is a cheap dependency-free stand-in
+    for semantic similarity.
+    """
+    kept: List[str] = []
+    kept_words: List[set] = []
+    for question in sub_questions:
+        words = set(_WORD_RE.findall(question.lower())) - _STOPWORDS
+        if words and any(
+            prev and len(words & prev) / len(words | prev) >= 0.6
+            for prev in kept_words
+        ):
+            continue
+        kept.append(question)
+        kept_words.append(words)
+    if len(kept) < len(sub_questions):
+        print(f"Decomposition: dropped {len(sub_questions) - len(kept)} near-duplicate sub-questions")
+    return kept
+
+# Strict JSON output: the model emits the object directly, so no retries
+# on prose-wrapped or malformed responses.
+_DECOMPOSITION_CONFIG = types.GenerateContentConfig(
+    response_mime_type='application/json',
+    response_schema={
+        'type': 'OBJECT',
+        'properties': {
+            'sub_questions': {'type': 'ARRAY', 'items': {'type': 'STRING'}},
+        },
+        'required': ['sub_questions'],
+    },
+)
+
+
+def _find_json_object(text: str) -> Optional[str]:
+    """
+    Return the first balanced {...} substring of `text`, or None.
+
+    Walks the string once tracking brace depth and string-literal state, so
+    extraction stays O(n) even when the model wraps the JSON in prose.
+    """
+    depth = 0
+    start = -1
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch == '{':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == '}':
+            if depth > 0:
+                depth -= 1
+                if depth == 0:
+                    return text[start:i + 1]
+    return None
+
 
 class DecompositionAgent(BaseAgent):
     """Agent specialized for breaking down a complex question into sub-questions."""
@@ -16,12 +95,8 @@ class DecompositionAgent(BaseAgent):
         """This agent does not process sources."""
         return sources
 
-    def decompose_question(self, user_question: str) -> List[str]:
-        """
-        Decomposes the user's main research question into several, more specific
-        sub-questions for detailed investigation.
-        """
-        prompt = f"""
+    def _build_decomposition_prompt(self, user_question: str) -> str:
+        return f"""
         You are a research strategist. Your task is to break down a complex user question into 3-5 specific, answerable sub-questions that can be used to search academic databases (like ArXiv) and video platforms (like YouTube).
 
         The sub-questions should cover different facets of the main topic, such as its definition, applications, challenges, and future trends.
@@ -43,26 +118,82 @@ class DecompositionAgent(BaseAgent):
         }}
         """
 
+    def decompose_question(self, user_question: str) -> List[str]:
+        """
+        Decomposes the user's main research question into several, more specific
+        sub-questions for detailed investigation.
+
+        The response is streamed and parsed incrementally: a parse is only
+        attempted when the buffered text looks complete, so the expensive
+        join+parse happens a handful of times instead of once per chunk.
+        """
         try:
-            response = self.client.models.generate_content(
+            chunks: List[str] = []
+            for chunk in self._stream_with_gate(lambda: self.client.models.generate_content_stream(
                 model=self.model,
-                contents=prompt
+                contents=self._build_decomposition_prompt(user_question),
+                config=_DECOMPOSITION_CONFIG
+            )):
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    if chunk.text.rstrip()[-1:] in '}]':
+                        parsed = self._try_parse_chunks(chunks)
+                        if parsed is not None:
+                            return _dedupe_sub_questions(parsed)
+            return _dedupe_sub_questions(
+                self._parse_sub_questions("".join(chunks).strip(), user_question)
             )
-            
-            # Clean the response to ensure it's valid JSON
-            response_text = response.text.strip() if response.text is not None else ""
-            # Find the start and end of the JSON object
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            if json_start != -1 and json_end != -1:
-                clean_json_str = response_text[json_start:json_end]
-                result = json.loads(clean_json_str)
-                return result.get("sub_questions", [user_question])
-            else:
-                 # Fallback if no JSON is found
-                return [user_question]
-
+        except LLMOverloadedError:
+            # Saturation must reach the route's 503 handler; falling back
+            # to the whole question would hide it behind a 200.
+            raise
         except Exception as e:
             print(f"Error during question decomposition: {e}")
             # Fallback to using the original question if decomposition fails
-            return [user_question]
\ No newline at end of file
+            return [user_question]
+
+    async def adecompose_question(self, user_question: str) -> List[str]:
+        """Async variant of decompose_question using the non-blocking client API."""
+        try:
+            chunks: List[str] = []
+            async for chunk in self._astream_with_gate(lambda: self.client.aio.models.generate_content_stream(
+                model=self.model,
+                contents=self._build_decomposition_prompt(user_question),
+                config=_DECOMPOSITION_CONFIG
+            )):
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    if chunk.text.rstrip()[-1:] in '}]':
+                        parsed = self._try_parse_chunks(chunks)
+                        if parsed is not None:
+                            return _dedupe_sub_questions(parsed)
+            return _dedupe_sub_questions(
+                self._parse_sub_questions("".join(chunks).strip(), user_question)
+            )
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            print(f"Error during question decomposition: {e}")
+            return [user_question]
+
+    def _try_parse_chunks(self, chunks: List[str]) -> Optional[List[str]]:
+        """Attempt to parse the streamed buffer; None means keep streaming."""
+        json_str = _find_json_object("".join(chunks))
+        if json_str is None:
+            return None
+        try:
+            result = orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            return None
+        sub_questions = result.get("sub_questions")
+        return sub_questions if sub_questions else None
+
+    def _parse_sub_questions(self, response_text: str, user_question: str) -> List[str]:
+        """Extract the sub-question list from the model's JSON response."""
+        # Extract the first balanced JSON object in a single pass
+        clean_json_str = _find_json_object(response_text)
+        if clean_json_str is not None:
+            result = orjson.loads(clean_json_str)
+            return result.get("sub_questions", [user_question])
+        # Fallback if no JSON is found
+        return [user_question]
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""
+Two-tier cache for LLM text outputs.
+
+The exact tier hashes the namespaced input and returns verbatim repeats
+for free. The fuzzy tier keeps a bounded index of content-word sets per
+namespace, so a paraphrase of an already-answered input can reuse its
+cached output instead of paying a second LLM generation. Content-word
+overlap stands in for an embedding-similarity index: no model download,
+no extra dependency, and cheap enough to run on every miss.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from ttl_cache import TTLCache
+
+_EXACT = TTLCache(maxsize=2048, ttl=3600)
+
+_WORD_RE = re.compile(r"[A-Za-z0-9']+")
+_STOPWORDS = {"the", "a", "an", "of", "in", "on", "for", "and", "to", "with", "is", "are", "how", "what", "why", "who", "where"}
+
+# Minimum Jaccard overlap of content words before two inputs count as the
+# same request. Tighter than the 0.6 used for sub-question dedup: serving
+# a cached answer for a genuinely different question is worse than a miss.
+_SIM_THRESHOLD = 0.75
+
+_FUZZY_MAX = 512
+_FUZZY_LOCK = threading.Lock()
+# exact-tier key -> (namespace, content-word set); insertion order doubles
+# as the eviction order once the index fills up.
+_FUZZY_INDEX: "OrderedDict[str, Tuple[str, frozenset]]" = OrderedDict()
+
+
+def _exact_key(namespace: str, key_text: str) -> str:
+    return hashlib.sha256(f"{namespace}\x00{key_text}".encode("utf-8", "replace")).hexdigest()
+
+
+def _content_words(text: str) -> frozenset:
+    return frozenset(w for w in _WORD_RE.findall(text.lower()) if w not in _STOPWORDS and len(w) > 2)
+
+
+def get(namespace: str, key_text: str, fuzzy_text: Optional[str] = None) -> Optional[str]:
+    """
+    Return the cached output for this input, or None.
+
+    `key_text` is matched exactly (after hashing); when `fuzzy_text` is
+    given, near-duplicates of it within the same namespace also hit.
+    """
+    value = _EXACT.get(_exact_key(namespace, key_text))
+    if value is not None:
+        return value
+    if not fuzzy_text:
+        return None
+    words = _content_words(fuzzy_text)
+    if not words:
+        return None
+    with _FUZZY_LOCK:
+        candidates = list(_FUZZY_INDEX.items())
+    best_key = None
+    best_sim = _SIM_THRESHOLD
+    for other_key, (other_ns, other_words) in candidates:
+        if other_ns != namespace:
+            continue
+        overlap = len(words & other_words)
+        if not overlap:
+            continue
+        sim = overlap / len(words | other_words)
+        if sim >= best_sim:
+            best_key, best_sim = other_key, sim
+    if best_key is None:
+        return None
+    return _EXACT.get(best_key)
+
+
+def put(namespace: str, key_text: str, value: str, fuzzy_text: Optional[str] = None) -> None:
+    """Store an LLM output under this input, optionally indexing it for fuzzy lookup."""
+    key = _exact_key(namespace, key_text)
+    _EXACT.set(key, value)
+    if not fuzzy_text:
+        return
+    words = _content_words(fuzzy_text)
+    if not words:
+        return
+    with _FUZZY_LOCK:
+        _FUZZY_INDEX[key] = (namespace, words)
+        _FUZZY_INDEX.move_to_end(key)
+        while len(_FUZZY_INDEX) > _FUZZY_MAX:
+            _FUZZY_INDEX.popitem(last=False)
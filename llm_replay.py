@@ -0,0 +1,54 @@
+"""
+Record/replay support for the manual test scripts.
+
+Running them with LLM_RECORD=1 saves the planner outputs for each test
+question to llm_fixtures.json; LLM_REPLAY=1 serves those saved outputs
+and raises on a miss, so a recorded script re-runs without a single LLM
+call. With neither variable set, attach() is a no-op and the scripts
+behave exactly as before.
+"""
+import functools
+import os
+
+import orjson
+
+RECORD = os.getenv("LLM_RECORD") == "1"
+REPLAY = os.getenv("LLM_REPLAY") == "1"
+
+_FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "llm_fixtures.json")
+
+_fixtures = {}
+if RECORD or REPLAY:
+    try:
+        with open(_FIXTURE_PATH, "rb") as f:
+            _fixtures = orjson.loads(f.read())
+    except FileNotFoundError:
+        _fixtures = {}
+
+
+def _recordable(bound_method):
+    name = bound_method.__name__
+
+    @functools.wraps(bound_method)
+    def wrapper(question, *args, **kwargs):
+        key = f"{name}:{question}"
+        if REPLAY:
+            if key not in _fixtures:
+                raise KeyError(f"No recorded fixture for {key!r}; run once with LLM_RECORD=1")
+            return _fixtures[key]
+        result = bound_method(question, *args, **kwargs)
+        if RECORD:
+            _fixtures[key] = result
+            with open(_FIXTURE_PATH, "wb") as f:
+                f.write(orjson.dumps(_fixtures, option=orjson.OPT_INDENT_2))
+        return result
+
+    return wrapper
+
+
+def attach(obj, *method_names):
+    """Wrap the named methods on obj with record/replay when a mode is active."""
+    if RECORD or REPLAY:
+        for name in method_names:
+            setattr(obj, name, _recordable(getattr(obj, name)))
+    return obj
@@ -1,16 +1,155 @@
 # main.py
 from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, StreamingResponse
+import orjson
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from arxiv_agent import ArxivAgent
+from base_agent import LLMOverloadedError, dedup_sources, llm_inflight
 from youtube_agent import YoutubeAgent
 from webpage_agent import WebpageAgent
 from synthesizer_agent import SynthesizerAgent
+from planner_agent import PlannerAgent
+from planner_agent_deep_research import PlannerAgentDeepResearch
 import uvicorn
-import traceback
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 
-app = FastAPI(title="Multi-Agent Research System", version="2.0")
+# Which agent set this process serves; one module covers what used to be
+# per-profile copies of this file. Construction stays inside the bundle
+# pool so importing the module never does network-bound client setup.
+#   direct        - fan out to arxiv/youtube/webpage and synthesize (default)
+#   planner       - strategy-driven research via PlannerAgent
+#   deep_research - question decomposition via PlannerAgentDeepResearch
+RESEARCH_PROFILE = os.getenv("RESEARCH_PROFILE", "direct")
+
+# Dedicated executor for blocking agent work. The loop's default pool is
+# small and shared with everything else offloaded on this worker, so
+# multi-second agent calls would saturate it and starve cheap handlers;
+# a named pool keeps agent concurrency independently sized.
+AGENT_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("AGENT_WORKERS", "64")),
+    thread_name_prefix="agent",
+)
+
+
+def _in_agent_pool(func, *args, **kwargs):
+    """Run a blocking agent call on the dedicated executor, awaitable."""
+    return asyncio.get_running_loop().run_in_executor(
+        AGENT_EXECUTOR, functools.partial(func, *args, **kwargs)
+    )
+
+
+
+class AgentBundle:
+    """One set of agents constructed already bound to a single model.
+
+    Bundles are immutable on the hot path: concurrent requests for
+    different models each get their own agents, so no update_model call
+    can bleed a model switch into another in-flight request.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.planner = None
+        if RESEARCH_PROFILE == "planner":
+            self.planner = PlannerAgent()
+            agents = (self.planner, self.planner.arxiv_agent,
+                      self.planner.youtube_agent, self.planner.webpage_agent,
+                      self.planner.webpage_agent.synthesizer_agent,
+                      self.planner.synthesizer_agent)
+        elif RESEARCH_PROFILE == "deep_research":
+            self.planner = PlannerAgentDeepResearch()
+            agents = (self.planner, self.planner.decomposition_agent,
+                      self.planner.arxiv_agent, self.planner.youtube_agent,
+                      self.planner.webpage_agent,
+                      self.planner.webpage_agent.synthesizer_agent,
+                      self.planner.synthesizer_agent)
+        else:
+            self.arxiv = ArxivAgent()
+            self.youtube = YoutubeAgent()
+            self.webpage = WebpageAgent()
+            self.synthesizer = SynthesizerAgent()
+            agents = (self.arxiv, self.youtube, self.webpage,
+                      self.webpage.synthesizer_agent, self.synthesizer)
+        for agent in agents:
+            agent.update_model(model)
+
+
+def _configure_logging() -> None:
+    """Configure root logging with a queue-backed handler.
+
+    This runs at import time rather than under __main__: uvicorn workers
+    are fresh processes that import this module without ever executing
+    the __main__ block, and an unconfigured root logger drops everything
+    below WARNING. Records route through a queue so emitting on the hot
+    path is a lock-free enqueue, and one listener thread serializes the
+    actual stream writes so concurrent tasks don't contend on stdout.
+    """
+    root = logging.getLogger()
+    if any(isinstance(h, QueueHandler) for h in root.handlers):
+        return  # already configured (reload / re-import)
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    log_queue: SimpleQueue = SimpleQueue()
+    listener = QueueListener(log_queue, *root.handlers)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+
+
+_configure_logging()
+
+logger = logging.getLogger(__name__)
+
+
+def _format_single_source(question: str, source: dict) -> str:
+    """Render a one-source answer without the synthesizer: there is nothing
+    to reconcile across sources, so the templated text is equivalent."""
+    title = source.get('title', 'Untitled')
+    link = source.get('link') or source.get('url', '#')
+    body = source.get('summary') or source.get('transcript') or source.get('content') or ''
+    return (
+        f"A single source was found for this question [1]:\n\n"
+        f"### {title}\n\n{body}"
+        f'\n\n## Sources\n<ol><li id="source-1">'
+        f'<a href="{link}" target="_blank" rel="noopener noreferrer">{title}</a></li></ol>'
+    )
+
+DEFAULT_MODEL = "gemma3:4b"
+_MAX_POOLED_MODELS = 4
+_AGENT_POOL: "OrderedDict[str, AgentBundle]" = OrderedDict()
+_POOL_LOCK = threading.Lock()
+
+
+def get_bundle(model: str) -> AgentBundle:
+    """Return the pooled bundle for `model`, building it lazily (LRU-capped)."""
+    with _POOL_LOCK:
+        bundle = _AGENT_POOL.get(model)
+        if bundle is None:
+            bundle = AgentBundle(model)
+            _AGENT_POOL[model] = bundle
+        _AGENT_POOL.move_to_end(model)
+        while len(_AGENT_POOL) > _MAX_POOLED_MODELS:
+            _AGENT_POOL.popitem(last=False)
+        return bundle
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the default bundle so the first request doesn't pay construction
+    get_bundle(DEFAULT_MODEL)
+    yield
+    AGENT_EXECUTOR.shutdown(wait=False)
+
+
+app = FastAPI(title="Multi-Agent Research System", version="2.0", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -18,8 +157,6 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Setup templates
 templates = Jinja2Templates(directory="templates")
 
-# Note: Agents will be created dynamically with the selected model
-
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Serve the main page."""
@@ -34,7 +171,8 @@ async def health_check():
         "modes": ["all_sources"],
         "models": ["gemma3:4b", "gpt-oss:latest", "gemini-2.0-flash"],
         "default_model": "gemma3:4b",
-        "agents": ["arxiv", "youtube", "webpage", "synthesizer"]
+        "agents": ["arxiv", "youtube", "webpage", "synthesizer"],
+        "llm_inflight": llm_inflight()
     }
 
 @app.post("/research") 
@@ -50,29 +188,21 @@ async def research(
 ):
     """Research using all sources directly without planner agent."""
     if not question:
-        return JSONResponse(content={'error': 'No question provided'}, status_code=400)
-    
-    # Note: webpage_url is optional; if empty we skip webpage analysis later
-    if not webpage_url:
-        print("INFO: No webpage URL provided - webpage analysis will be skipped if empty")
-    else:
-        print(f"INFO: Webpage URL provided in form: '{webpage_url}'")
-    
-    # Debug: Print all received form data
-    # Extra visibility: show raw form fields received
-    try:
-        form_dump = await request.form()
-        print(f"Raw form keys: {list(form_dump.keys())}")
-        print(f"Raw form 'webpage_url': '{form_dump.get('webpage_url', '')}'")
-    except Exception as _e:
-        print(f"Could not dump raw form: {_e}")
-
-    print(f"Form data received:")
-    print(f"  question: '{question}'")
-    print(f"  webpage_url: '{webpage_url}'")
-    print(f"  model: '{model}'")
-    print(f"  max_sources: {max_sources}")
-    
+        return ORJSONResponse(content={'error': 'No question provided'}, status_code=400)
+
+    # Bound the question before it reaches any LLM prompt: a pathological
+    # input would otherwise be repeated verbatim into every agent's prompt.
+    question = question.strip()
+    if len(question) < 3:
+        return ORJSONResponse(content={'error': 'Question is too short'}, status_code=400)
+    if len(question) > 2000:
+        question = question[:2000]
+
+    # FastAPI already parsed the form via Form(...); no need to re-read the
+    # body here, and logger.debug is a no-op unless debug logging is enabled.
+    logger.debug("form: q=%r url=%r model=%s max=%d", question, webpage_url, model, max_sources)
+
+
     # Validate max_sources range
     if max_sources < 1:
         max_sources = 1
@@ -82,81 +212,134 @@ async def research(
     try:
         print(f"Researching with all sources using model: {model} for: {question}")
         
-        # Create agents dynamically with the selected model
-        arxiv_agent = ArxivAgent()
-        youtube_agent = YoutubeAgent()
-        webpage_agent = WebpageAgent()
-        synthesizer_agent = SynthesizerAgent()
-        
-        # Update all agents to use the selected model
-        arxiv_agent.update_model(model)
-        youtube_agent.update_model(model)
-        webpage_agent.update_model(model)
-        webpage_agent.synthesizer_agent.update_model(model)
-        synthesizer_agent.update_model(model)
+        # Agents come pre-bound to the requested model; nothing mutates here
+        bundle = get_bundle(model)
+
+        # Planner profiles delegate the whole workflow to their coordinator;
+        # the frontend already understands the {result, strategy, ...} shape.
+        if bundle.planner is not None:
+            # Streaming-capable planners send the report token by token as
+            # SSE frames; Starlette iterates the sync generator in a worker
+            # thread, so the research stages don't block the event loop.
+            if ("text/event-stream" in request.headers.get("accept", "")
+                    and hasattr(bundle.planner, "run_stream")):
+                def planner_sse_frames():
+                    try:
+                        for chunk in bundle.planner.run_stream(
+                            question,
+                            webpage_url=webpage_url.strip() if webpage_url else '',
+                            max_sources=max_sources,
+                            date_from=date_from,
+                            date_to=date_to,
+                            transcript_limit=3000,
+                        ):
+                            yield b"data: " + orjson.dumps({"delta": chunk}) + b"\n\n"
+                    except Exception as e:
+                        logger.exception("streamed planner research failed", extra={"question": question, "model": model})
+                        yield b"data: " + orjson.dumps({"error": str(e)}) + b"\n\n"
+                    yield b"data: [DONE]\n\n"
+
+                return StreamingResponse(planner_sse_frames(), media_type="text/event-stream")
+
+            planner_result = await _in_agent_pool(
+                bundle.planner.run,
+                question,
+                webpage_url=webpage_url.strip() if webpage_url else '',
+                max_sources=max_sources,
+                date_from=date_from,
+                date_to=date_to,
+                transcript_limit=3000,
+            )
+            return ORJSONResponse(content={'answer': planner_result})
+
+        arxiv_agent = bundle.arxiv
+        youtube_agent = bundle.youtube
+        webpage_agent = bundle.webpage
+        synthesizer_agent = bundle.synthesizer
         
         all_results = []
         all_sources = []
-        
-        # 1. Search ArXiv
-        print("Searching ArXiv...")
-        try:
-            arxiv_results = arxiv_agent.run(
+
+        # Dispatch the enabled agents concurrently: each is dominated by
+        # remote LLM/API latency, so total wall-clock becomes max(agent)
+        # instead of sum(agent).
+        labels = ["ArXiv Research", "YouTube Research"]
+        tasks = [
+            arxiv_agent.arun(
                 user_question=question,
                 max_sources=max_sources,
                 date_from=date_from,
                 date_to=date_to
-            )
-            if arxiv_results:
-                all_results.append(f"**ArXiv Research:**\n{arxiv_results}")
-                all_sources.extend(arxiv_results.get('sources', []))
-                print("ArXiv search completed successfully")
-        except Exception as e:
-            print(f"ArXiv search failed: {e}")
-            all_results.append(f"**ArXiv Research:** Failed to retrieve results - {str(e)}")
-        
-        # 2. Search YouTube
-        print("Searching YouTube...")
-        try:
-            youtube_results = youtube_agent.run(
+            ),
+            youtube_agent.arun(
                 user_question=question,
                 max_sources=max_sources,
                 transcript_limit=3000
-            )
-            if youtube_results:
-                all_results.append(f"**YouTube Research:**\n{youtube_results}")
-                all_sources.extend(youtube_results.get('sources', []))
-                print("YouTube search completed successfully")
-        except Exception as e:
-            print(f"YouTube search failed: {e}")
-            all_results.append(f"**YouTube Research:** Failed to retrieve results - {str(e)}")
-        
-        # 3. Search Webpage (if URL provided)
-        print(f"Webpage URL received: '{webpage_url}'")  # Debug line
+            ),
+        ]
         if webpage_url and webpage_url.strip():
             print(f"Analyzing webpage: {webpage_url}")
-            try:
-                webpage_results = webpage_agent.run(
-                    user_question=question,
-                    url=webpage_url.strip()
-                )
-                if webpage_results:
-                    all_results.append(f"**Webpage Analysis:**\n{webpage_results}")
-                    all_sources.extend(webpage_results.get('sources', []))
-                    print("Webpage analysis completed successfully")
-                else:
-                    print("Webpage analysis returned empty results")
-            except Exception as e:
-                print(f"Webpage analysis failed: {e}")
-                print(f"Webpage error traceback: {traceback.format_exc()}")
-                all_results.append(f"**Webpage Analysis:** Failed to analyze webpage - {str(e)}")
+            labels.append("Webpage Analysis")
+            tasks.append(_in_agent_pool(
+                webpage_agent.run,
+                user_question=question,
+                url=webpage_url.strip()
+            ))
         else:
             print("No webpage URL provided or URL is empty")
-        
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        for label, result in zip(labels, results):
+            if isinstance(result, LLMOverloadedError):
+                # Saturation is a whole-process condition, not a per-agent
+                # failure; surface it to the 503 handler below.
+                raise result
+            if isinstance(result, Exception):
+                print(f"{label} failed: {result}")
+                all_results.append(f"**{label}:** Failed to retrieve results - {result}")
+            else:
+                all_results.append(f"**{label}:**\n{result.summary}")
+                all_sources.extend(result.sources)
+                print(f"{label} completed successfully")
+
         # 4. Synthesize all results
         if all_results:
             print("Synthesizing all results...")
             combined_research = "\n\n".join(all_results)
+
+            # Skip duplicates that showed up from more than one agent so
+            # synthesis doesn't pay their prompt tokens twice.
+            deduped = dedup_sources(all_sources)
+            if len(deduped) < len(all_sources):
+                print(f"Dropped {len(all_sources) - len(deduped)} duplicate sources before synthesis")
+            all_sources = deduped
+
+            # Synthesis is the most expensive LLM call in the pipeline and
+            # only adds value when several sources need reconciling; with
+            # zero or one source, answer directly.
+            if not all_sources:
+                return ORJSONResponse(content={'answer': combined_research})
+            if len(all_sources) == 1:
+                print("Single source found - skipping synthesis")
+                return ORJSONResponse(content={'answer': _format_single_source(question, all_sources[0])})
+
+            # Streaming clients get the answer token by token as SSE frames:
+            # time-to-first-token instead of full-answer latency. The plain
+            # JSON path below stays for clients that don't opt in.
+            if "text/event-stream" in request.headers.get("accept", ""):
+                def sse_frames():
+                    try:
+                        for chunk in synthesizer_agent.synthesize_stream(
+                            user_question=question, all_sources=all_sources
+                        ):
+                            yield b"data: " + orjson.dumps({"delta": chunk}) + b"\n\n"
+                    except Exception as e:
+                        logger.exception("streaming synthesis failed", extra={"model": model})
+                        yield b"data: " + orjson.dumps({"error": str(e)}) + b"\n\n"
+                    yield b"data: [DONE]\n\n"
+
+                return StreamingResponse(sse_frames(), media_type="text/event-stream")
             
             # synthesis_prompt = f"""
             # Based on the following research from multiple sources, provide a comprehensive answer to the question: "{question}"
@@ -172,19 +355,40 @@ async def research(
             
             try:
                 # Use synthesizer's LLM directly instead of the run method that searches for sources
-                final_answer = synthesizer_agent.synthesize(user_question=question, all_sources=all_sources)
-                return JSONResponse(content={'answer': final_answer})
-            except Exception as e:
-                print(f"Synthesis failed: {e}")
+                final_answer = await _in_agent_pool(
+                    synthesizer_agent.synthesize, user_question=question, all_sources=all_sources
+                )
+                return ORJSONResponse(content={'answer': final_answer})
+            except LLMOverloadedError:
+                raise
+            except Exception:
+                logger.exception("synthesis failed", extra={"model": model})
                 # If synthesis fails, return the raw results
-                return JSONResponse(content={'answer': combined_research})
+                return ORJSONResponse(content={'answer': combined_research})
         else:
-            return JSONResponse(content={'answer': 'No results found from any source. Please try a different question or check your parameters.'})
+            return ORJSONResponse(content={'answer': 'No results found from any source. Please try a different question or check your parameters.'})
         
+    except LLMOverloadedError:
+        # Fail fast instead of queueing unboundedly: the client gets a
+        # clean back-off signal and this request's state is freed.
+        return ORJSONResponse(
+            content={'error': 'Server is overloaded, please retry shortly'},
+            status_code=503,
+            headers={'Retry-After': '2'},
+        )
     except Exception as e:
-        print(f"Research failed: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
-        return JSONResponse(content={'error': f'Research failed: {str(e)}'}, status_code=500)
+        # logger.exception defers stack formatting to the emitting handler,
+        # unlike the old print(traceback.format_exc()) pair which walked and
+        # formatted the stack eagerly on every failure.
+        logger.exception("research failed", extra={"question": question, "model": model})
+        return ORJSONResponse(content={'error': f'Research failed: {str(e)}'}, status_code=500)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Single-process serving caps an I/O-bound workload at one event loop;
+    # scale workers with cores unless WEB_CONCURRENCY says otherwise.
+    uvicorn.run(
+        "main_multiagent:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 2)),
+    )
@@ -1,9 +1,67 @@
+import asyncio
+import re
+import orjson
 from typing import Dict, List, Any, Optional
-from base_agent import BaseAgent
+from base_agent import BaseAgent, LLMOverloadedError, dedup_sources, run_coroutine
 from arxiv_agent import ArxivAgent
 from youtube_agent import YoutubeAgent
 from synthesizer_agent import SynthesizerAgent
 from webpage_agent import WebpageAgent
+from ttl_cache import TTLCache
+
+# Strategy dicts are tiny and stable for a given question/model/mode, so
+# repeated questions skip the planner LLM round-trip entirely.
+_PLAN_CACHE = TTLCache(maxsize=10000, ttl=24 * 3600)
+
+# Fallback parse for models that ignore the JSON instruction
+_PLAN_LINE_RE = re.compile(r'^(arxiv|youtube|webpage|complexity|recency|reasoning):\s*(.+)$', re.I | re.M)
+
+# Built once at import: the strategy prompt is static apart from the
+# question and whether a URL was supplied, so per-call work is one
+# format_map instead of re-assembling the whole template.
+_ANALYZE_PROMPT_TPL = """
+        Analyze the following research question and determine the best research strategy:
+
+        Question: "{question}"
+        Webpage URL provided: {url_present}
+
+        Consider:
+        1. Does this question need academic/scientific papers? (ArXiv useful: yes/no)
+        2. Does this question need recent trends/discussions/tutorials? (YouTube useful: yes/no)
+        3. Is there a specific webpage to analyze? (Webpage useful: yes/no)
+        4. What is the complexity level? (simple/medium/complex)
+        5. What is the urgency for recent information? (low/medium/high)
+
+        Respond as compact JSON with exactly these keys:
+        {{"arxiv": "yes/no", "youtube": "yes/no", "webpage": "yes/no", "complexity": "simple/medium/complex", "recency": "low/medium/high", "reasoning": "brief explanation"}}
+        """
+
+
+def _build_plan_table():
+    """Enumerate every (max_sources, flags) combination once at import.
+
+    max_sources is clamped to 1-10 and there are three boolean agent
+    flags, so the whole allocation space is 80 entries; a dict lookup
+    replaces the per-request arithmetic and flag normalization.
+    """
+    table = {}
+    for max_sources in range(1, 11):
+        for use_arxiv in (False, True):
+            for use_youtube in (False, True):
+                for use_webpage in (False, True):
+                    arxiv, youtube, webpage = use_arxiv, use_youtube, use_webpage
+                    if not (arxiv or youtube or webpage):
+                        arxiv = youtube = True  # Default to ArXiv and YouTube
+                    per_agent = max(1, max_sources // (arxiv + youtube + webpage))
+                    table[(max_sources, use_arxiv, use_youtube, use_webpage)] = (
+                        per_agent if arxiv else 0,
+                        per_agent if youtube else 0,
+                        per_agent if webpage else 0,
+                    )
+    return table
+
+
+_PLAN_TABLE = _build_plan_table()
 
 class PlannerAgent(BaseAgent):
     """
@@ -28,52 +86,23 @@ class PlannerAgent(BaseAgent):
     def analyze_query(self, user_question: str, **kwargs) -> Dict[str, Any]:
         """Analyze the user query to determine research strategy."""
         webpage_url = kwargs.get('webpage_url', '')
-        
-        prompt = f"""
-        Analyze the following research question and determine the best research strategy:
 
-        Question: "{user_question}"
-        Webpage URL provided: {"Yes" if webpage_url else "No"}
+        cache_key = (self.model, user_question.lower().strip(), bool(webpage_url))
+        cached = _PLAN_CACHE.get(cache_key)
+        if cached is not None:
+            return dict(cached)
 
-        Consider:
-        1. Does this question need academic/scientific papers? (ArXiv useful: yes/no)
-        2. Does this question need recent trends/discussions/tutorials? (YouTube useful: yes/no)
-        3. Is there a specific webpage to analyze? (Webpage useful: yes/no)
-        4. What is the complexity level? (simple/medium/complex)
-        5. What is the urgency for recent information? (low/medium/high)
-
-        Respond in this exact format:
-        ArXiv: yes/no
-        YouTube: yes/no
-        Webpage: yes/no
-        Complexity: simple/medium/complex
-        Recency: low/medium/high
-        Reasoning: [brief explanation]
-        """
+        prompt = _ANALYZE_PROMPT_TPL.format_map({
+            "question": user_question,
+            "url_present": "Yes" if webpage_url else "No",
+        })
         
         try:
-            if "gemini" in self.model.lower():
-                response = self.client.models.generate_content(
-                    model=self.model,
-                    contents=prompt
-                )
-                analysis_text = response.text.strip() if response.text is not None else ""
-            else:
-                response = self.client.generate(
-                    model=self.model,
-                    prompt=prompt
-                )
-                analysis_text = response['response'] if response['response'] is not None else ""
-
-            
-            # Parse the response
-            analysis = {}
-            for line in analysis_text.split('\n'):
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    analysis[key.strip().lower()] = value.strip().lower()
-            
-            return {
+            analysis_text = self._call_with_retry(lambda: self._complete(prompt)).strip()
+
+            analysis = self._parse_analysis(analysis_text)
+
+            strategy = {
                 'use_arxiv': analysis.get('arxiv', 'yes') == 'yes',
                 'use_youtube': analysis.get('youtube', 'yes') == 'yes',
                 'use_webpage': analysis.get('webpage', 'yes') == 'yes' and bool(webpage_url),
@@ -81,6 +110,12 @@ class PlannerAgent(BaseAgent):
                 'recency': analysis.get('recency', 'medium'),
                 'reasoning': analysis.get('reasoning', 'Standard research approach')
             }
+            _PLAN_CACHE.set(cache_key, dict(strategy))
+            return strategy
+        except LLMOverloadedError:
+            # Saturation must reach the route's 503 handler; the default
+            # strategy below would hide it behind a 200.
+            raise
         except Exception as e:
             print(f"Query analysis failed: {e}")
             # Default strategy
@@ -93,63 +128,130 @@ class PlannerAgent(BaseAgent):
                 'reasoning': 'Default comprehensive research approach'
             }
     
+    def _parse_analysis(self, analysis_text: str) -> Dict[str, str]:
+        """Parse the strategy response: JSON first, labeled-line regex as fallback."""
+        json_start = analysis_text.find('{')
+        json_end = analysis_text.rfind('}') + 1
+        if json_start != -1 and json_end > json_start:
+            try:
+                parsed = orjson.loads(analysis_text[json_start:json_end])
+                return {str(k).strip().lower(): str(v).strip().lower() for k, v in parsed.items()}
+            except orjson.JSONDecodeError:
+                pass
+        return {k.lower(): v.strip().lower() for k, v in _PLAN_LINE_RE.findall(analysis_text)}
+
     def execute_research_plan(self, user_question: str, strategy: Dict[str, Any], **kwargs) -> str:
         """Execute the research plan based on the strategy."""
         all_sources = []
         max_sources = kwargs.get('max_sources', 10)
         webpage_url = kwargs.get('webpage_url', '')
         
-        # Calculate source distribution
-        active_agents = sum([strategy['use_arxiv'], strategy['use_youtube'], strategy['use_webpage']])
-        if active_agents == 0:
-            active_agents = 2  # Default to ArXiv and YouTube
-            strategy['use_arxiv'] = True
-            strategy['use_youtube'] = True
-        
-        sources_per_agent = max(1, max_sources // active_agents)
-        
-        print(f"Research plan: ArXiv={strategy['use_arxiv']}, YouTube={strategy['use_youtube']}, Webpage={strategy['use_webpage']}")
+        # Source distribution comes from the precomputed allocation table
+        n_arxiv, n_youtube, n_webpage = _PLAN_TABLE[(
+            min(max(max_sources, 1), 10),
+            strategy['use_arxiv'], strategy['use_youtube'], strategy['use_webpage']
+        )]
+
+        print(f"Research plan: ArXiv={n_arxiv}, YouTube={n_youtube}, Webpage={n_webpage}")
         
         # Execute ArXiv research
-        if strategy['use_arxiv']:
+        if n_arxiv:
             try:
                 arxiv_result = self.arxiv_agent.run(
                     user_question,
-                    max_results=sources_per_agent,
+                    max_results=n_arxiv,
                     date_from=kwargs.get('date_from'),
                     date_to=kwargs.get('date_to')
                 )
-                all_sources.extend(arxiv_result.get('sources', []))
+                all_sources.extend(arxiv_result.sources)
             except Exception as e:
                 print(f"ArXiv research failed: {e}")
         
         # Execute YouTube research
-        if strategy['use_youtube']:
+        if n_youtube:
             try:
                 youtube_result = self.youtube_agent.run(
                     user_question,
-                    max_results=sources_per_agent,
+                    max_results=n_youtube,
                     transcript_limit=kwargs.get('transcript_limit', 3000)
                 )
-                all_sources.extend(youtube_result.get('sources', []))
+                all_sources.extend(youtube_result.sources)
             except Exception as e:
                 print(f"YouTube research failed: {e}")
         
         # Execute Webpage research
-        if strategy['use_webpage'] and webpage_url:
+        if n_webpage and webpage_url:
             try:
                 webpage_result = self.webpage_agent.run(
                     user_question,
                     url=webpage_url
                 )
-                all_sources.extend(webpage_result.get('sources', []))
+                all_sources.extend(webpage_result.sources)
             except Exception as e:
                 print(f"Webpage research failed: {e}")
         
-        # Synthesize results
-        print(f"Synthesizing {len(all_sources)} total sources...")
-        return self.synthesizer_agent.synthesize(user_question, all_sources)
+        # Synthesize results, skipping cross-agent duplicates
+        deduped = dedup_sources(all_sources)
+        if len(deduped) < len(all_sources):
+            print(f"Dropped {len(all_sources) - len(deduped)} duplicate sources before synthesis")
+        print(f"Synthesizing {len(deduped)} total sources...")
+        return self.synthesizer_agent.synthesize(user_question, deduped)
     
+    async def aexecute_research_plan(self, user_question: str, strategy: Dict[str, Any], **kwargs) -> str:
+        """Async variant of execute_research_plan that runs the enabled agents concurrently."""
+        all_sources = []
+        max_sources = kwargs.get('max_sources', 10)
+        webpage_url = kwargs.get('webpage_url', '')
+
+        # Source distribution comes from the precomputed allocation table
+        n_arxiv, n_youtube, n_webpage = _PLAN_TABLE[(
+            min(max(max_sources, 1), 10),
+            strategy['use_arxiv'], strategy['use_youtube'], strategy['use_webpage']
+        )]
+
+        print(f"Research plan: ArXiv={n_arxiv}, YouTube={n_youtube}, Webpage={n_webpage}")
+
+        labels = []
+        tasks = []
+        if n_arxiv:
+            labels.append("ArXiv")
+            tasks.append(self.arxiv_agent.arun(
+                user_question,
+                max_results=n_arxiv,
+                date_from=kwargs.get('date_from'),
+                date_to=kwargs.get('date_to')
+            ))
+        if n_youtube:
+            labels.append("YouTube")
+            tasks.append(self.youtube_agent.arun(
+                user_question,
+                max_results=n_youtube,
+                transcript_limit=kwargs.get('transcript_limit', 3000)
+            ))
+        if n_webpage and webpage_url:
+            labels.append("Webpage")
+            tasks.append(asyncio.to_thread(
+                self.webpage_agent.run,
+                user_question,
+                url=webpage_url
+            ))
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for label, result in zip(labels, results):
+            if isinstance(result, LLMOverloadedError):
+                raise result
+            if isinstance(result, Exception):
+                print(f"{label} research failed: {result}")
+            else:
+                all_sources.extend(result.sources)
+
+        # Synthesize results, skipping cross-agent duplicates
+        deduped = dedup_sources(all_sources)
+        if len(deduped) < len(all_sources):
+            print(f"Dropped {len(all_sources) - len(deduped)} duplicate sources before synthesis")
+        print(f"Synthesizing {len(deduped)} total sources...")
+        return await asyncio.to_thread(self.synthesizer_agent.synthesize, user_question, deduped)
+
     def run(self, user_question: str, **kwargs) -> Dict[str, Any]:
         """Main execution method that coordinates the entire research process."""
         print(f"{self.name}: Starting comprehensive research...")
@@ -158,8 +260,12 @@ class PlannerAgent(BaseAgent):
         strategy = self.analyze_query(user_question, **kwargs)
         print(f"{self.name}: Strategy - {strategy['reasoning']}")
         
-        # Execute the research plan
-        result = self.execute_research_plan(user_question, strategy, **kwargs)
+        # Execute the research plan with the enabled agents fanned out
+        # concurrently: each agent's query-generation/search/processing
+        # pipeline overlaps the others instead of running back to back.
+        # The shared background loop (rather than asyncio.run) keeps the
+        # pooled async HTTP connections valid across requests.
+        result = run_coroutine(self.aexecute_research_plan(user_question, strategy, **kwargs))
         
         print(f"{self.name}: Research complete!")
         return {
@@ -1,10 +1,25 @@
-from typing import Dict, List, Any, Optional
-from base_agent import BaseAgent
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import orjson
+import re
+from typing import Dict, Iterator, List, Any, Optional
+from base_agent import BaseAgent, LLMOverloadedError, run_coroutine
 from arxiv_agent import ArxivAgent
 from youtube_agent import YoutubeAgent
 from synthesizer_agent_deep_research import SynthesizerAgentDeepResearch
 from decomposition_agent import DecompositionAgent
 from webpage_agent import WebpageAgent
+from ttl_cache import TTLCache
+
+# Strategy dicts are tiny and stable for a given question/model, so repeat
+# deep-research runs skip the analysis LLM round-trip entirely.
+_PLAN_CACHE = TTLCache(maxsize=10000, ttl=24 * 3600)
+
+logger = logging.getLogger(__name__)
+
+# Fallback parse for models that ignore the JSON instruction
+_PLAN_LINE_RE = re.compile(r'^(arxiv|youtube|webpage|complexity|recency|reasoning):\s*(.+)$', re.I | re.M)
 
 class PlannerAgentDeepResearch(BaseAgent):
     """
@@ -30,6 +45,11 @@ class PlannerAgentDeepResearch(BaseAgent):
     def analyze_query(self, user_question: str, **kwargs) -> Dict[str, Any]:
         """Analyze the user query to determine research strategy."""
         webpage_url = kwargs.get('webpage_url', '')
+
+        cache_key = (self.model, user_question.lower().strip(), bool(webpage_url))
+        cached = _PLAN_CACHE.get(cache_key)
+        if cached is not None:
+            return dict(cached)
         
         prompt = f"""
         Analyze the following research question and determine the best research strategy:
@@ -44,30 +64,16 @@ class PlannerAgentDeepResearch(BaseAgent):
         4. What is the complexity level? (simple/medium/complex)
         5. What is the urgency for recent information? (low/medium/high)
 
-        Respond in this exact format:
-        ArXiv: yes/no
-        YouTube: yes/no
-        Webpage: yes/no
-        Complexity: simple/medium/complex
-        Recency: low/medium/high
-        Reasoning: [brief explanation]
+        Respond as compact JSON with exactly these keys:
+        {{"arxiv": "yes/no", "youtube": "yes/no", "webpage": "yes/no", "complexity": "simple/medium/complex", "recency": "low/medium/high", "reasoning": "brief explanation"}}
         """
         
         try:
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=prompt
-            )
-            analysis_text = response.text.strip() if response.text is not None else ""
-            
-            # Parse the response
-            analysis = {}
-            for line in analysis_text.split('\n'):
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    analysis[key.strip().lower()] = value.strip().lower()
+            analysis_text = self._call_with_retry(lambda: self._complete(prompt)).strip()
+
+            analysis = self._parse_analysis(analysis_text)
             
-            return {
+            strategy = {
                 'use_arxiv': analysis.get('arxiv', 'yes') == 'yes',
                 'use_youtube': analysis.get('youtube', 'yes') == 'yes',
                 'use_webpage': analysis.get('webpage', 'yes') == 'yes' and bool(webpage_url),
@@ -75,8 +81,14 @@ class PlannerAgentDeepResearch(BaseAgent):
                 'recency': analysis.get('recency', 'medium'),
                 'reasoning': analysis.get('reasoning', 'Standard research approach')
             }
+            _PLAN_CACHE.set(cache_key, dict(strategy))
+            return strategy
+        except LLMOverloadedError:
+            # Saturation must reach the route's 503 handler; the default
+            # strategy below would hide it behind a 200.
+            raise
         except Exception as e:
-            print(f"Query analysis failed: {e}")
+            logger.warning("Query analysis failed: %s", e)
             # Default strategy
             return {
                 'use_arxiv': True,
@@ -87,11 +99,92 @@ class PlannerAgentDeepResearch(BaseAgent):
                 'reasoning': 'Default comprehensive research approach'
             }
     
-    def execute_research_plan(self, sub_question: str, strategy: Dict[str, Any], **kwargs) -> List[Dict[str, Any]]:
-        """Execute the research plan based on the strategy."""
-        sub_question_sources = []
-        max_sources = kwargs.get('max_sources', 10)
+
+    def _parse_analysis(self, analysis_text: str) -> Dict[str, str]:
+        """Parse the strategy response: JSON first, labeled-line regex as fallback."""
+        json_start = analysis_text.find('{')
+        json_end = analysis_text.rfind('}') + 1
+        if json_start != -1 and json_end > json_start:
+            try:
+                parsed = orjson.loads(analysis_text[json_start:json_end])
+                return {str(k).strip().lower(): str(v).strip().lower() for k, v in parsed.items()}
+            except orjson.JSONDecodeError:
+                pass
+        return {k.lower(): v.strip().lower() for k, v in _PLAN_LINE_RE.findall(analysis_text)}
+
+    def analyze_sub_questions(self, user_question: str, sub_questions: List[str], **kwargs) -> List[Dict[str, Any]]:
+        """
+        Determine a research strategy for every sub-question in one LLM call.
+
+        One batched request replaces a planning round-trip per sub-question;
+        the model returns a JSON array that maps back to the sub-questions
+        by position. Falls back to one shared whole-question strategy if the
+        batch response cannot be parsed.
+        """
+        if not sub_questions:
+            return []
         webpage_url = kwargs.get('webpage_url', '')
+
+        numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(sub_questions, 1))
+        prompt = f"""
+        The following research question was decomposed into sub-questions.
+        Determine the best research strategy for EACH sub-question.
+
+        Original question: "{user_question}"
+        Webpage URL provided: {"Yes" if webpage_url else "No"}
+
+        Sub-questions:
+        {numbered}
+
+        Return ONLY a JSON array with one object per sub-question, in order,
+        each with exactly these keys:
+        {{"arxiv": "yes/no", "youtube": "yes/no", "webpage": "yes/no", "complexity": "simple/medium/complex", "recency": "low/medium/high", "reasoning": "brief explanation"}}
+        """
+
+        try:
+            analysis_text = self._call_with_retry(lambda: self._complete(prompt)).strip()
+            json_start = analysis_text.find('[')
+            json_end = analysis_text.rfind(']') + 1
+            if json_start == -1 or json_end <= json_start:
+                raise ValueError("No JSON array in batch analysis response")
+            parsed = orjson.loads(analysis_text[json_start:json_end])
+            if not isinstance(parsed, list) or len(parsed) != len(sub_questions):
+                raise ValueError(f"Expected {len(sub_questions)} strategies, got {len(parsed) if isinstance(parsed, list) else type(parsed)}")
+
+            strategies = []
+            for entry in parsed:
+                analysis = {str(k).strip().lower(): str(v).strip().lower() for k, v in entry.items()}
+                strategies.append({
+                    'use_arxiv': analysis.get('arxiv', 'yes') == 'yes',
+                    'use_youtube': analysis.get('youtube', 'yes') == 'yes',
+                    'use_webpage': analysis.get('webpage', 'yes') == 'yes' and bool(webpage_url),
+                    'complexity': analysis.get('complexity', 'medium'),
+                    'recency': analysis.get('recency', 'medium'),
+                    'reasoning': analysis.get('reasoning', 'Standard research approach')
+                })
+            return strategies
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            logger.warning("Batch sub-question analysis failed: %s", e)
+            shared = self.analyze_query(user_question, **kwargs)
+            return [dict(shared) for _ in sub_questions]
+
+    async def execute_research_plan(
+        self,
+        sub_question: str,
+        strategy: Dict[str, Any],
+        max_sources: int = 10,
+        webpage_url: str = '',
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        transcript_limit: int = 3000,
+        first_sub_question: Optional[str] = None,
+        arxiv_query: Optional[str] = None,
+        youtube_query: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Execute the research plan for one sub-question, agents running concurrently."""
+        sub_question_sources = []
         
         # Calculate source distribution
         active_agents = sum([strategy['use_arxiv'], strategy['use_youtube'], strategy['use_webpage']])
@@ -102,89 +195,205 @@ class PlannerAgentDeepResearch(BaseAgent):
         
         sources_per_agent = max(1, max_sources // active_agents)
         
-        print(f"Executing research for sub-question: '{sub_question}'")
-        print(f"Research plan: ArXiv={strategy['use_arxiv']}, YouTube={strategy['use_youtube']}, Webpage={strategy['use_webpage']}")
+        logger.info("Executing research for sub-question: %r", sub_question)
+        logger.info("Research plan: ArXiv=%s, YouTube=%s, Webpage=%s", strategy['use_arxiv'], strategy['use_youtube'], strategy['use_webpage'])
         
-        # Execute ArXiv research
+        labels = []
+        tasks = []
         if strategy['use_arxiv']:
-            try:
-                arxiv_result = self.arxiv_agent.run(
-                    sub_question,
-                    max_results=sources_per_agent,
-                    date_from=kwargs.get('date_from'),
-                    date_to=kwargs.get('date_to')
-                )
-                sub_question_sources.extend(arxiv_result.get('sources', []))
-            except Exception as e:
-                print(f"ArXiv research failed for sub-question '{sub_question}': {e}")
-        
-        # Execute YouTube research
+            labels.append("ArXiv")
+            tasks.append(self.arxiv_agent.arun(
+                sub_question,
+                search_query=arxiv_query,
+                max_results=sources_per_agent,
+                date_from=date_from,
+                date_to=date_to
+            ))
         if strategy['use_youtube']:
-            try:
-                youtube_result = self.youtube_agent.run(
-                    sub_question,
-                    max_results=sources_per_agent,
-                    transcript_limit=kwargs.get('transcript_limit', 3000)
-                )
-                sub_question_sources.extend(youtube_result.get('sources', []))
-            except Exception as e:
-                print(f"YouTube research failed for sub-question '{sub_question}': {e}")
-        
-        # Execute Webpage research (only for the first sub-question to avoid duplication)
-        if strategy['use_webpage'] and webpage_url and sub_question == kwargs.get('first_sub_question'):
-            try:
-                webpage_result = self.webpage_agent.run(
-                    sub_question,
-                    url=webpage_url
-                )
-                sub_question_sources.extend(webpage_result.get('sources', []))
-            except Exception as e:
-                print(f"Webpage research failed for sub-question '{sub_question}': {e}")
+            labels.append("YouTube")
+            tasks.append(self.youtube_agent.arun(
+                sub_question,
+                search_query=youtube_query,
+                max_results=sources_per_agent,
+                transcript_limit=transcript_limit
+            ))
+        # Webpage research only for the first sub-question to avoid duplication
+        if strategy['use_webpage'] and webpage_url and sub_question == first_sub_question:
+            labels.append("Webpage")
+            tasks.append(asyncio.to_thread(
+                self.webpage_agent.run,
+                sub_question,
+                url=webpage_url
+            ))
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for label, result in zip(labels, results):
+            if isinstance(result, LLMOverloadedError):
+                raise result
+            if isinstance(result, Exception):
+                logger.warning("%s research failed for sub-question %r: %s", label, sub_question, result)
+            else:
+                sub_question_sources.extend(result.sources)
         
         return sub_question_sources
+
+    async def _aresearch_sub_questions(self, sub_questions: List[str], strategies: List[Dict[str, Any]], **kwargs) -> List[Dict[str, Any]]:
+        """
+        Research all sub-questions concurrently, deduplicating as results land.
+
+        Each sub-question is pure I/O-bound fan-out, so overlapping them
+        turns O(N * per-question time) into roughly max(per-question time);
+        the semaphore bounds how many run at once. Producers push each
+        sub-question's sources onto a queue the moment they arrive, and a
+        consumer dedupes them while the remaining research is still in
+        flight, so the synthesis stage starts with a ready-made source list
+        instead of doing that pass after the last sub-question finishes.
+        """
+        semaphore = asyncio.Semaphore(4)
+        queue: asyncio.Queue = asyncio.Queue()
+
+        # Read the knobs once instead of copying kwargs per sub-question;
+        # the first sub-question is the only one that does webpage research.
+        max_sources = kwargs.get('max_sources', 5)
+        webpage_url = kwargs.get('webpage_url', '')
+        date_from = kwargs.get('date_from')
+        date_to = kwargs.get('date_to')
+        transcript_limit = kwargs.get('transcript_limit', 3000)
+        first_sub_question = sub_questions[0] if sub_questions else None
+
+        # Pre-generate the search queries for all sub-questions in one
+        # batched LLM call per agent type, instead of paying a query
+        # round-trip inside every arun below.
+        arxiv_queries: List[Optional[str]] = [None] * len(sub_questions)
+        youtube_queries: List[Optional[str]] = [None] * len(sub_questions)
+        batch_agents = []
+        if any(s['use_arxiv'] for s in strategies):
+            batch_agents.append(('arxiv', self.arxiv_agent))
+        if any(s['use_youtube'] for s in strategies):
+            batch_agents.append(('youtube', self.youtube_agent))
+        if batch_agents:
+            batches = await asyncio.gather(*(
+                asyncio.to_thread(agent.generate_search_queries_batch, sub_questions)
+                for _, agent in batch_agents
+            ))
+            for (kind, _), batch in zip(batch_agents, batches):
+                if kind == 'arxiv':
+                    arxiv_queries = batch
+                else:
+                    youtube_queries = batch
+
+        async def _bounded_plan(index: int, sub_q: str) -> None:
+            async with semaphore:
+                sources = await self.execute_research_plan(
+                    sub_q,
+                    strategies[index - 1],
+                    max_sources=max_sources,
+                    webpage_url=webpage_url,
+                    date_from=date_from,
+                    date_to=date_to,
+                    transcript_limit=transcript_limit,
+                    first_sub_question=first_sub_question,
+                    arxiv_query=arxiv_queries[index - 1],
+                    youtube_query=youtube_queries[index - 1],
+                )
+            await queue.put(sources)
+
+        unique_sources: List[Dict[str, Any]] = []
+        seen_keys: set = set()
+
+        async def _consume() -> None:
+            while True:
+                batch = await queue.get()
+                for source in batch:
+                    key = source.get('link') or source.get('url') or source.get('title')
+                    if key in seen_keys:
+                        continue
+                    seen_keys.add(key)
+                    unique_sources.append(source)
+                queue.task_done()
+
+        consumer = asyncio.ensure_future(_consume())
+        try:
+            await asyncio.gather(
+                *(_bounded_plan(i, sq) for i, sq in enumerate(sub_questions, 1))
+            )
+            await queue.join()
+        finally:
+            consumer.cancel()
+        return unique_sources
     
+    def _decompose_and_analyze(self, user_question: str, **kwargs) -> tuple:
+        """Run question decomposition and whole-question strategy analysis
+        concurrently; both depend only on the user question."""
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            decompose_future = pool.submit(self.decomposition_agent.decompose_question, user_question)
+            strategy_future = pool.submit(self.analyze_query, user_question, **kwargs)
+            return decompose_future.result(), strategy_future.result()
+
     def run(self, user_question: str, **kwargs) -> Dict[str, Any]:
         """
         Main execution method that coordinates the entire DEEP research process.
         """
-        print(f"{self.name}: Starting comprehensive research for: '{user_question}'")
-        all_sources = []
-        
-        # Step 1: Decompose the main question
-        print(f"{self.name}: Decomposing main question...")
-        sub_questions = self.decomposition_agent.decompose_question(user_question)
-        print(f"{self.name}: Generated {len(sub_questions)} sub-questions.")
-
-        # Step 2: Analyze the query to create a general strategy
-        strategy = self.analyze_query(user_question, **kwargs)
-        print(f"{self.name}: Using strategy - {strategy['reasoning']}")
-
-        # Step 3: Iterate and execute research for each sub-question
-        for i, sub_q in enumerate(sub_questions, 1):
-            print(f"\n--- Processing Sub-Question {i}/{len(sub_questions)} ---")
-            sources_per_sq = kwargs.get('max_sources', 5)
-            print(f"Allocating {sources_per_sq} sources for this sub-question.")
-            
-            sub_q_kwargs = kwargs.copy()
-            sub_q_kwargs['max_sources'] = sources_per_sq
-            # Mark the first sub-question for webpage processing
-            if i == 1:
-                sub_q_kwargs['first_sub_question'] = sub_q
-
-            # Execute the plan for the sub-question
-            sources_for_sub_q = self.execute_research_plan(sub_q, strategy, **sub_q_kwargs)
-            all_sources.extend(sources_for_sub_q)
+        logger.info("%s: Starting comprehensive research for: %r", self.name, user_question)
+
+        # Step 1: Decompose the question and analyze the whole question
+        # concurrently - both are LLM round-trips that only need
+        # user_question, so overlapping them hides one full round-trip.
+        # The whole-question strategy also seeds the plan cache, making the
+        # batch-analysis fallback below a cache hit instead of another call.
+        logger.info("%s: Decomposing main question...", self.name)
+        sub_questions, fallback_strategy = self._decompose_and_analyze(user_question, **kwargs)
+        logger.info("%s: Generated %d sub-questions.", self.name, len(sub_questions))
+
+        # Step 2: Analyze all sub-questions in one batched LLM call
+        strategies = self.analyze_sub_questions(user_question, sub_questions, **kwargs)
+        strategy = strategies[0] if strategies else fallback_strategy
+        logger.info("%s: Using strategy - %s", self.name, strategy['reasoning'])
+
+        # Step 3: Research all sub-questions concurrently. The shared
+        # background loop (rather than asyncio.run) keeps the pooled async
+        # HTTP connections valid across requests.
+        logger.info("--- Researching %d sub-questions concurrently ---", len(sub_questions))
+        all_sources = run_coroutine(
+            self._aresearch_sub_questions(sub_questions, strategies, **kwargs)
+        )
         
-        print(f"\n--- Synthesis Stage ---")
-        print(f"{self.name}: Aggregated {len(all_sources)} sources from all sub-questions.")
+        logger.info("--- Synthesis Stage ---")
+        # Sources were already deduplicated while research was in flight, so
+        # synthesis doesn't pay the same paper's or video's prompt tokens twice.
+        logger.info("%s: Aggregated %d unique sources from all sub-questions.", self.name, len(all_sources))
 
         # Step 4: Synthesize the final report from all collected sources
         final_report = self.synthesizer_agent.synthesize(user_question, all_sources)
         
-        print(f"{self.name}: Research complete!")
+        logger.info("%s: Research complete!", self.name)
         return {
             "result": final_report,
             "strategy": strategy,
             "sub_questions": sub_questions,
             "agent": self.name
-        }
\ No newline at end of file
+        }
+
+    def run_stream(self, user_question: str, **kwargs) -> Iterator[str]:
+        """
+        Same workflow as run(), but the final report is yielded as token
+        chunks instead of returned whole: callers see the first tokens at
+        first-token latency rather than waiting for the full deep report.
+        """
+        logger.info("%s: Starting comprehensive research for: %r", self.name, user_question)
+
+        sub_questions, _ = self._decompose_and_analyze(user_question, **kwargs)
+        logger.info("%s: Generated %d sub-questions.", self.name, len(sub_questions))
+
+        strategies = self.analyze_sub_questions(user_question, sub_questions, **kwargs)
+
+        logger.info("--- Researching %d sub-questions concurrently ---", len(sub_questions))
+        all_sources = run_coroutine(
+            self._aresearch_sub_questions(sub_questions, strategies, **kwargs)
+        )
+
+        logger.info("--- Synthesis Stage ---")
+        logger.info("%s: Aggregated %d unique sources from all sub-questions.", self.name, len(all_sources))
+
+        yield from self.synthesizer_agent.synthesize_stream(user_question, all_sources)
+        logger.info("%s: Research complete!", self.name)
\ No newline at end of file
@@ -76,6 +76,18 @@ function initModelSelection() {
     }
 }
 
+// Render streamed markdown into HTML with clickable citation markers
+function renderAnswerHtml(markdownText) {
+    const html = marked.parse(markdownText);
+    return html.replace(/\[([\d,\s]+)\]/g, (match, innerContent) => {
+        const links = innerContent.split(',')
+            .map(num => num.trim())
+            .map(num => `<a href="#source-${num}" class="citation-link">${num}</a>`)
+            .join(', ');
+        return `[${links}]`;
+    });
+}
+
 document.getElementById('research-form').addEventListener('submit', async function(e) {
     e.preventDefault();
 
@@ -152,9 +164,60 @@ document.getElementById('research-form').addEventListener('submit', async functi
 
         const response = await fetch('/research', {
             method: 'POST',
-            body: formData
+            body: formData,
+            headers: { 'Accept': 'text/event-stream' }
         });
 
+        // Streaming path: render the answer as the tokens arrive instead of
+        // waiting for the synthesizer to finish the whole report.
+        const contentType = response.headers.get('content-type') || '';
+        if (contentType.includes('text/event-stream')) {
+            clearInterval(textInterval);
+            loading.style.display = 'none';
+
+            marked.setOptions({ gfm: true, breaks: true });
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let answerText = '';
+            let streamError = null;
+            let finished = false;
+
+            while (!finished) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                const frames = buffer.split('\n\n');
+                buffer = frames.pop();
+                for (const frame of frames) {
+                    if (!frame.startsWith('data: ')) continue;
+                    const payload = frame.slice(6);
+                    if (payload === '[DONE]') {
+                        finished = true;
+                        break;
+                    }
+                    const msg = JSON.parse(payload);
+                    if (msg.error) {
+                        streamError = msg.error;
+                    } else if (msg.delta) {
+                        answerText += msg.delta;
+                        resultsContainer.innerHTML = renderAnswerHtml(answerText);
+                    }
+                }
+            }
+
+            if (streamError) {
+                resultsContainer.innerHTML = `<div class="alert alert-danger">${streamError}</div>`;
+            } else if (answerText) {
+                resultsContainer.innerHTML = renderAnswerHtml(answerText);
+            } else {
+                resultsContainer.innerHTML = '<div class="alert alert-warning">No results found</div>';
+            }
+            return;
+        }
+
         const data = await response.json();
 
         if (data.error) {
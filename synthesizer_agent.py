@@ -1,5 +1,33 @@
-from typing import Dict, List, Any
-from base_agent import BaseAgent
+from typing import Dict, Iterator, List, Any, Tuple
+import hashlib
+
+from base_agent import BaseAgent, LLMOverloadedError, truncate_for_prompt
+import llm_cache
+
+# Static instruction prefix, hoisted so it is byte-identical on every call.
+# Provider-side prompt caches key on the leading tokens: keeping the
+# instructions fixed and putting the question/context in the dynamic suffix
+# lets repeated syntheses hit the cached prefix.
+_SYNTHESIS_INSTRUCTIONS = """You are a meticulous research analyst. Your task is to write a comprehensive, well-structured report that answers the user's question by synthesizing information from the provided sources.
+
+**Instructions:**
+1. Write a coherent report that integrates the findings from all sources.
+2. For every claim or finding you take from a source, you **must** add a citation marker at the end of the sentence, like `[1]`, `[2]`, or `[1, 3]`.
+3. Base your answer *only* on the information provided in the sources below. Do not use outside knowledge.
+4. Structure your response with clear paragraphs and logical flow.
+5. If sources contradict each other, mention this and present both perspectives.
+6. Do NOT add a "Sources" heading or list. Produce ONLY the report text.
+"""
+
+
+# Overall token budget for the source context, split evenly across
+# sources (capped at 400 tokens each) so prompt size stays bounded no
+# matter how many transcripts come back.
+_CONTEXT_TOKEN_BUDGET = 30000
+
+# Source-list row templates, defined once at module scope
+_LI_TPL = '<li id="source-{i}"><a href="{link}" target="_blank" rel="noopener noreferrer">{title}</a></li>'
+_LI_YOUTUBE_TPL = '<li id="source-{i}"><a href="{link}" target="_blank" rel="noopener noreferrer">{title}</a> - {channel}</li>'
 
 class SynthesizerAgent(BaseAgent):
     """Agent specialized for synthesizing information from multiple sources."""
@@ -15,73 +43,145 @@ class SynthesizerAgent(BaseAgent):
         """Synthesizer processes sources by creating the final report."""
         return sources
     
+    def _build_prompt(self, user_question: str, all_sources: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """Build the dynamic prompt body and the HTML source list appended to the report."""
+        # Deterministic source order: identical source sets produce an
+        # identical prompt body regardless of agent completion order.
+        all_sources = sorted(
+            all_sources,
+            key=lambda s: s.get('link') or s.get('url') or s.get('title') or ''
+        )
+
+        per_source_tokens = max(100, min(400, _CONTEXT_TOKEN_BUDGET // len(all_sources)))
+
+        # Partition by source_type up front so each inner loop below is a
+        # tight, branch-free append; the running counter `i` keeps the [i]
+        # citation indices aligned between context and source list.
+        arxiv_sources = [s for s in all_sources if s.get('source_type') == 'arxiv']
+        youtube_sources = [s for s in all_sources if s.get('source_type') == 'youtube']
+        webpage_sources = [s for s in all_sources if s.get('source_type') == 'webpage']
+
+        # Create context for LLM; list-append + join keeps the build O(N)
+        # where += concatenation would recopy the string per source
+        context_parts = []
+        html_parts = ["\n\n## Sources\n<ol>"]
+        i = 0
+
+        for source in arxiv_sources:
+            i += 1
+            title = source.get('title', 'No Title')
+            info = truncate_for_prompt(source.get('summary', ''), per_source_tokens)
+            link = source.get('link', '#')
+            context_parts.append(f"Source [{i}]: Title: {title}. Summary: {info}\n\n")
+            html_parts.append(_LI_TPL.format(i=i, link=link, title=title))
+
+        for source in youtube_sources:
+            i += 1
+            title = source.get('title', 'No Title')
+            info = truncate_for_prompt(source.get('transcript', 'No transcript available.'), per_source_tokens)
+            link = source.get('url', '#')
+            channel = source.get('channelTitle', '')
+            context_parts.append(f"Source [{i}]: Title: {title}. Channel: {channel}. Transcript: {info}\n\n")
+            html_parts.append(_LI_YOUTUBE_TPL.format(i=i, link=link, title=title, channel=channel))
+
+        for source in webpage_sources:
+            i += 1
+            title = source.get('title', 'No Title')
+            info = truncate_for_prompt(source.get('content', 'No content available.'), per_source_tokens)
+            link = source.get('link', '#')
+            context_parts.append(f"Source [{i}]: Title: {title}. Content: {info}\n\n")
+            html_parts.append(_LI_TPL.format(i=i, link=link, title=title))
+
+        context = "".join(context_parts)
+        source_list_html = "".join(html_parts) + "</ol>"
+        
+        # Only the dynamic part; the instruction prefix travels as the
+        # system instruction so providers can cache it.
+        prompt = f"""**Original User Question:** "{user_question}"
+
+**Sources:**
+{context}
+
+Produce a comprehensive report text as requested.
+"""
+        return prompt, source_list_html
+
     def synthesize(self, user_question: str, all_sources: List[Dict[str, Any]]) -> str:
         """Create a comprehensive report from all sources."""
         if not all_sources:
             return "No relevant sources were found to answer your question."
-        
-        # Create context for LLM
-        context = ""
-        source_list_html = "\n\n## Sources\n<ol>"
-        
-        for i, source in enumerate(all_sources, 1):
-            if source.get('source_type') == 'arxiv':
-                title = source.get('title', 'No Title')
-                info = source.get('summary', '')
-                link = source.get('link', '#')
-                context += f"Source [{i}]: Title: {title}. Summary: {info}\n\n"
-                source_list_html += f'<li id="source-{i}"><a href="{link}" target="_blank" rel="noopener noreferrer">{title}</a></li>'
-            
-            elif source.get('source_type') == 'youtube':
-                title = source.get('title', 'No Title')
-                info = source.get('transcript', 'No transcript available.')
-                link = source.get('url', '#')
-                channel = source.get('channelTitle', '')
-                context += f"Source [{i}]: Title: {title}. Channel: {channel}. Transcript: {info}\n\n"
-                source_list_html += f'<li id="source-{i}"><a href="{link}" target="_blank" rel="noopener noreferrer">{title}</a> - {channel}</li>'
-            
-            elif source.get('source_type') == 'webpage':
-                title = source.get('title', 'No Title')
-                info = source.get('content', 'No content available.')
-                link = source.get('link', '#')
-                context += f"Source [{i}]: Title: {title}. Content: {info}\n\n"
-                source_list_html += f'<li id="source-{i}"><a href="{link}" target="_blank" rel="noopener noreferrer">{title}</a></li>'
-        
-        source_list_html += "</ol>"
-        
-        # Create synthesis prompt
-        prompt = f"""
-        You are a meticulous research analyst. Your task is to write a comprehensive, well-structured report that answers the user's question by synthesizing information from the provided sources.
-
-        **Instructions:**
-        1. Write a coherent report that integrates the findings from all sources.
-        2. For every claim or finding you take from a source, you **must** add a citation marker at the end of the sentence, like `[1]`, `[2]`, or `[1, 3]`.
-        3. Base your answer *only* on the information provided in the sources below. Do not use outside knowledge.
-        4. Structure your response with clear paragraphs and logical flow.
-        5. If sources contradict each other, mention this and present both perspectives.
-        6. Do NOT add a "Sources" heading or list. Produce ONLY the report text.
 
-        **Original User Question:** "{user_question}"
+        prompt, source_list_html = self._build_prompt(user_question, all_sources)
 
-        **Sources:**
-        {context}
+        # Repeat syntheses over the same source set skip the LLM entirely;
+        # the fuzzy tier also catches the question asked in other words.
+        # Hashing the sorted links into the namespace scopes fuzzy matches
+        # to identical source sets.
+        links = ",".join(sorted((s.get('link') or s.get('url') or s.get('title') or '') for s in all_sources))
+        cache_ns = f"synthesis:{self.model}:{hashlib.sha256(links.encode()).hexdigest()}"
+        cached = llm_cache.get(cache_ns, user_question.strip().lower(), fuzzy_text=user_question)
+        if cached is not None:
+            return cached
 
-        Produce a comprehensive report text as requested.
-        """
-        
         try:
             if "gemini" in self.model.lower():
-                response = self.client.models.generate_content(
+                response = self._call_with_retry(lambda: self.client.models.generate_content(
                     model=self.model,
-                    contents=prompt
-                )
+                    contents=prompt,
+                    config={'system_instruction': _SYNTHESIS_INSTRUCTIONS}
+                ))
                 report_text = response.text.strip() if response.text is not None else ""
             else:
-                response = self.client.generate(
+                response = self._call_with_retry(lambda: self.client.generate(
                     model=self.model,
-                    prompt=prompt
-                )
+                    prompt=prompt,
+                    system=_SYNTHESIS_INSTRUCTIONS
+                ))
                 report_text = response['response'] if response['response'] is not None else ""
-            return report_text + source_list_html
+            report = report_text + source_list_html
+            llm_cache.put(cache_ns, user_question.strip().lower(), report, fuzzy_text=user_question)
+            return report
+        except LLMOverloadedError:
+            # Saturation must reach the route's 503 handler; an error
+            # string here would ship it to the client as a 200.
+            raise
+        except Exception as e:
+            return f"Error during synthesis: {e}"
+
+    def synthesize_stream(self, user_question: str, all_sources: List[Dict[str, Any]]) -> Iterator[str]:
+        """
+        Yield the report as token chunks instead of buffering the full answer.
+
+        The caller sees the first token as soon as the model emits it, so
+        perceived latency is first-token time rather than full-answer time.
+        The HTML source list is yielded last, after the report text.
+        """
+        if not all_sources:
+            yield "No relevant sources were found to answer your question."
+            return
+
+        prompt, source_list_html = self._build_prompt(user_question, all_sources)
+
+        try:
+            if "gemini" in self.model.lower():
+                for chunk in self._stream_with_gate(lambda: self.client.models.generate_content_stream(
+                    model=self.model,
+                    contents=prompt,
+                    config={'system_instruction': _SYNTHESIS_INSTRUCTIONS}
+                )):
+                    if chunk.text:
+                        yield chunk.text
+            else:
+                for part in self._stream_with_gate(lambda: self.client.generate(
+                    model=self.model,
+                    prompt=prompt,
+                    system=_SYNTHESIS_INSTRUCTIONS,
+                    stream=True
+                )):
+                    if part.get('response'):
+                        yield part['response']
+            yield source_list_html
+        except LLMOverloadedError:
+            raise
         except Exception as e:
-            return f"Error during synthesis: {e}"
\ No newline at end of file
+            yield f"Error during synthesis: {e}"
\ No newline at end of file
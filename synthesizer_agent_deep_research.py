@@ -1,5 +1,140 @@
-from typing import Dict, List, Any
-from base_agent import BaseAgent
+from typing import Dict, Iterator, List, Any, Optional, Tuple
+import hashlib
+import threading
+import time
+
+from base_agent import BaseAgent, LLMOverloadedError, truncate_for_prompt
+import llm_cache
+
+# Static instruction prefix, hoisted so it is byte-identical on every call.
+# Provider-side prompt caches key on the leading tokens: a fixed system
+# instruction plus a dynamic question/context suffix lets repeated deep
+# syntheses hit the cached prefix.
+_DEEP_SYNTHESIS_INSTRUCTIONS = """You are an expert research analyst specializing in comprehensive report synthesis. Your task is to produce a thorough, analytical report that definitively answers the user's original question by synthesizing information from multiple research sources.
+
+**Context:**
+You have been provided with sources gathered through systematic research of sub-questions derived from the original inquiry. These sources represent the complete knowledge base for your analysis.
+
+**Core Objectives:**
+1. **Comprehensively answer** the original user question with depth and nuance
+2. **Synthesize and integrate** findings across all sources to identify patterns, themes, and connections
+3. **Analyze relationships** between different pieces of information rather than simply summarizing
+4. **Evaluate evidence quality** and highlight areas of strong vs. weak support
+5. **Identify gaps** where information may be incomplete or contradictory
+
+**Critical Requirements:**
+
+**Evidence & Citations:**
+- Every factual claim, statistic, or finding MUST include citation markers: `[1]`, `[2]`, `[1,3]`
+- Base conclusions ONLY on provided sources - no external knowledge
+- When synthesizing across multiple sources, cite all relevant sources: `[2,4,7]`
+- Distinguish between well-supported claims and those with limited evidence
+
+**Analysis Depth:**
+- Go beyond summarization - identify trends, implications, and underlying patterns
+- Draw connections between seemingly disparate findings
+- Assess the strength and limitations of the evidence
+- Address contradictions explicitly and evaluate which sources are more credible
+
+**Structure & Clarity:**
+- Use the exact Markdown format specified below
+- Ensure logical flow with smooth transitions between sections
+- Write for an educated audience seeking comprehensive understanding
+- Maintain objectivity while providing clear, actionable insights
+
+**Handling Contradictions:**
+When sources disagree:
+- Present all perspectives fairly
+- Evaluate which sources appear more credible and why
+- Explain the nature and significance of the disagreement
+- Indicate if contradictions can be reconciled or if they represent genuine uncertainty
+
+**MANDATORY REPORT STRUCTURE:**
+
+# Executive Summary
+(2-3 paragraphs: Core findings, main conclusion, and key implications. This should be comprehensive enough to stand alone.)
+
+## Introduction
+(Establish context, scope, and importance of the question. Define key terms if necessary. Outline what the report will cover.)
+
+## Methodology & Source Overview
+(Brief description of the research approach and types/quality of sources analyzed. Note any limitations in the available data.)
+
+## Key Findings
+(Organize into 3-5 thematic subsections with descriptive headings. Each subsection should:)
+- **Integrate multiple sources** to build comprehensive understanding
+- **Use bullet points** for complex information when helpful
+- **Bold key concepts** for emphasis
+- **Analyze rather than just describe** - explain significance and implications
+- **Every statement must be cited**
+
+### [Thematic Subsection 1]
+(Content with analysis and citations)
+
+### [Thematic Subsection 2]
+(Content with analysis and citations)
+
+[Continue as needed...]
+
+## Critical Analysis
+(Evaluate the overall strength of evidence, identify key limitations, discuss areas of uncertainty, and note important gaps in knowledge.)
+
+## Implications & Future Considerations
+(Discuss broader significance, potential consequences, and areas needing further research based on the findings.)
+
+## Conclusion
+(Synthesize main points into a definitive answer to the original question. Highlight the most important takeaways and their significance.)
+
+**IMPORTANT NOTES:**
+- Do NOT add a "Sources" or "References" section - this will be appended automatically
+- Your response should end with the Conclusion section
+- Aim for thoroughness while maintaining readability
+- If the sources don't adequately address the original question, acknowledge this limitation
+"""
+
+# Server-side Gemini context cache for the instruction block above, one
+# handle per model. With cached_content the provider skips re-tokenizing
+# and re-prefilling the (large, byte-identical) prefix on every call and
+# only processes the per-request question/context. Created lazily on
+# first use and refreshed before the TTL runs out; when creation fails
+# (model without cache support, prefix under the size minimum, old SDK)
+# the calls below fall back to plain system_instruction.
+_CONTEXT_CACHE_TTL = 3600
+_CONTEXT_CACHE_LOCK = threading.Lock()
+_CONTEXT_CACHES: Dict[str, Tuple[Optional[str], float]] = {}
+
+
+def _get_context_cache(client, model: str) -> Optional[str]:
+    now = time.monotonic()
+    with _CONTEXT_CACHE_LOCK:
+        entry = _CONTEXT_CACHES.get(model)
+        # Refresh slightly early so in-flight calls never hit an expired cache
+        if entry is not None and now - entry[1] < _CONTEXT_CACHE_TTL - 300:
+            return entry[0]
+    try:
+        cache = client.caches.create(
+            model=model,
+            config={
+                'system_instruction': _DEEP_SYNTHESIS_INSTRUCTIONS,
+                'ttl': f'{_CONTEXT_CACHE_TTL}s',
+            },
+        )
+        name = cache.name
+    except Exception:
+        name = None
+    with _CONTEXT_CACHE_LOCK:
+        _CONTEXT_CACHES[model] = (name, now)
+    return name
+
+
+# Overall token budget for the source context, split evenly across
+# sources (capped at 400 tokens each) so prompt size stays bounded no
+# matter how many transcripts come back.
+_CONTEXT_TOKEN_BUDGET = 30000
+
+# Source-list row templates, defined once at module scope
+_LI_TPL = '<li id="source-{i}"><a href="{link}" target="_blank" rel="noopener noreferrer">{title}</a></li>'
+_LI_YOUTUBE_TPL = '<li id="source-{i}"><a href="{link}" target="_blank" rel="noopener noreferrer">{title}</a> - {channel}</li>'
 
 class SynthesizerAgentDeepResearch(BaseAgent):
     """Agent specialized for synthesizing information from multiple sources."""
@@ -15,137 +150,154 @@ class SynthesizerAgentDeepResearch(BaseAgent):
         """Synthesizer processes sources by creating the final report."""
         return sources
     
-    def synthesize(self, user_question: str, all_sources: List[Dict[str, Any]]) -> str:
-        """Create a comprehensive report from all sources."""
-        if not all_sources:
-            return "No relevant sources were found to answer your question."
-        
-        # Create context for LLM
-        context = ""
-        source_list_html = "\n\n<h2 id='sources'>Sources</h2>\n<ol>"
-        
-        for i, source in enumerate(all_sources, 1):
-            if source.get('source_type') == 'arxiv':
-                title = source.get('title', 'No Title')
-                info = source.get('summary', '')
-                link = source.get('link', '#')
-                context += f"Source [{i}]: Title: {title}. Summary: {info}\n\n"
-                source_list_html += f'<li id="source-{i}"><a href="{link}" target="_blank" rel="noopener noreferrer">{title}</a></li>'
-            
-            elif source.get('source_type') == 'youtube':
-                title = source.get('title', 'No Title')
-                info = source.get('transcript', 'No transcript available.')
-                link = source.get('url', '#')
-                channel = source.get('channelTitle', '')
-                context += f"Source [{i}]: Title: {title}. Channel: {channel}. Transcript: {info}\n\n"
-                source_list_html += f'<li id="source-{i}"><a href="{link}" target="_blank" rel="noopener noreferrer">{title}</a> - {channel}</li>'
-            
-            elif source.get('source_type') == 'webpage':
-                title = source.get('title', 'No Title')
-                info = source.get('content', 'No content available.')
-                link = source.get('link', '#')
-                context += f"Source [{i}]: Title: {title}. Content: {info}\n\n"
-                source_list_html += f'<li id="source-{i}"><a href="{link}" target="_blank" rel="noopener noreferrer">{title}</a></li>'
-        
-        source_list_html += "</ol>"
-        
-        # Create synthesis prompt
-        prompt = f"""
-        You are an expert research analyst specializing in comprehensive report synthesis. Your task is to produce a thorough, analytical report that definitively answers the user's original question by synthesizing information from multiple research sources.
-
-        **Context:**
-        You have been provided with sources gathered through systematic research of sub-questions derived from the original inquiry. These sources represent the complete knowledge base for your analysis.
-
-        **Core Objectives:**
-        1. **Comprehensively answer** the original user question with depth and nuance
-        2. **Synthesize and integrate** findings across all sources to identify patterns, themes, and connections
-        3. **Analyze relationships** between different pieces of information rather than simply summarizing
-        4. **Evaluate evidence quality** and highlight areas of strong vs. weak support
-        5. **Identify gaps** where information may be incomplete or contradictory
-
-        **Critical Requirements:**
-
-        **Evidence & Citations:**
-        - Every factual claim, statistic, or finding MUST include citation markers: `[1]`, `[2]`, `[1,3]`
-        - Base conclusions ONLY on provided sources - no external knowledge
-        - When synthesizing across multiple sources, cite all relevant sources: `[2,4,7]`
-        - Distinguish between well-supported claims and those with limited evidence
+    def _build_prompt(self, user_question: str, all_sources: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """Build the dynamic prompt body and the HTML source list appended to the report."""
+        # Deterministic source order: identical source sets produce an
+        # identical prompt body regardless of agent completion order.
+        all_sources = sorted(
+            all_sources,
+            key=lambda s: s.get('link') or s.get('url') or s.get('title') or ''
+        )
 
-        **Analysis Depth:**
-        - Go beyond summarization - identify trends, implications, and underlying patterns
-        - Draw connections between seemingly disparate findings
-        - Assess the strength and limitations of the evidence
-        - Address contradictions explicitly and evaluate which sources are more credible
+        per_source_tokens = max(100, min(400, _CONTEXT_TOKEN_BUDGET // len(all_sources)))
 
-        **Structure & Clarity:**
-        - Use the exact Markdown format specified below
-        - Ensure logical flow with smooth transitions between sections
-        - Write for an educated audience seeking comprehensive understanding
-        - Maintain objectivity while providing clear, actionable insights
+        # Partition by source_type up front so each inner loop below is a
+        # tight, branch-free append; the running counter `i` keeps the [i]
+        # citation indices aligned between context and source list.
+        arxiv_sources = [s for s in all_sources if s.get('source_type') == 'arxiv']
+        youtube_sources = [s for s in all_sources if s.get('source_type') == 'youtube']
+        webpage_sources = [s for s in all_sources if s.get('source_type') == 'webpage']
 
-        **Handling Contradictions:**
-        When sources disagree:
-        - Present all perspectives fairly
-        - Evaluate which sources appear more credible and why
-        - Explain the nature and significance of the disagreement
-        - Indicate if contradictions can be reconciled or if they represent genuine uncertainty
+        # Create context for LLM; list-append + join keeps the build O(N)
+        # where += concatenation would recopy the string per source
+        context_parts = []
+        html_parts = ["\n\n<h2 id='sources'>Sources</h2>\n<ol>"]
+        i = 0
 
-        **MANDATORY REPORT STRUCTURE:**
+        for source in arxiv_sources:
+            i += 1
+            title = source.get('title', 'No Title')
+            info = truncate_for_prompt(source.get('summary', ''), per_source_tokens)
+            link = source.get('link', '#')
+            context_parts.append(f"Source [{i}]: Title: {title}. Summary: {info}\n\n")
+            html_parts.append(_LI_TPL.format(i=i, link=link, title=title))
 
-        # Executive Summary
-        (2-3 paragraphs: Core findings, main conclusion, and key implications. This should be comprehensive enough to stand alone.)
+        for source in youtube_sources:
+            i += 1
+            title = source.get('title', 'No Title')
+            info = truncate_for_prompt(source.get('transcript', 'No transcript available.'), per_source_tokens)
+            link = source.get('url', '#')
+            channel = source.get('channelTitle', '')
+            context_parts.append(f"Source [{i}]: Title: {title}. Channel: {channel}. Transcript: {info}\n\n")
+            html_parts.append(_LI_YOUTUBE_TPL.format(i=i, link=link, title=title, channel=channel))
 
-        ## Introduction
-        (Establish context, scope, and importance of the question. Define key terms if necessary. Outline what the report will cover.)
+        for source in webpage_sources:
+            i += 1
+            title = source.get('title', 'No Title')
+            info = truncate_for_prompt(source.get('content', 'No content available.'), per_source_tokens)
+            link = source.get('link', '#')
+            context_parts.append(f"Source [{i}]: Title: {title}. Content: {info}\n\n")
+            html_parts.append(_LI_TPL.format(i=i, link=link, title=title))
 
-        ## Methodology & Source Overview
-        (Brief description of the research approach and types/quality of sources analyzed. Note any limitations in the available data.)
+        context = "".join(context_parts)
+        source_list_html = "".join(html_parts) + "</ol>"
+        
+        # Only the dynamic part; the instruction prefix travels as the
+        # system instruction so providers can cache it.
+        prompt = f"""**Original User Question:** "{user_question}"
 
-        ## Key Findings
-        (Organize into 3-5 thematic subsections with descriptive headings. Each subsection should:)
-        - **Integrate multiple sources** to build comprehensive understanding
-        - **Use bullet points** for complex information when helpful
-        - **Bold key concepts** for emphasis
-        - **Analyze rather than just describe** - explain significance and implications
-        - **Every statement must be cited**
+**Research Sources:**
+{context}
 
-        ### [Thematic Subsection 1]
-        (Content with analysis and citations)
+Produce a comprehensive, analytical report following the structure above.
+"""
+        return prompt, source_list_html
 
-        ### [Thematic Subsection 2]
-        (Content with analysis and citations)
+    def _gemini_config(self) -> Dict[str, Any]:
+        """Request config for Gemini calls: the server-side instruction cache
+        when available, otherwise the instructions inline."""
+        cache_name = _get_context_cache(self.client, self.model)
+        if cache_name:
+            return {'cached_content': cache_name}
+        return {'system_instruction': _DEEP_SYNTHESIS_INSTRUCTIONS}
 
-        [Continue as needed...]
+    def synthesize(self, user_question: str, all_sources: List[Dict[str, Any]]) -> str:
+        """Create a comprehensive report from all sources."""
+        if not all_sources:
+            return "No relevant sources were found to answer your question."
 
-        ## Critical Analysis
-        (Evaluate the overall strength of evidence, identify key limitations, discuss areas of uncertainty, and note important gaps in knowledge.)
+        prompt, source_list_html = self._build_prompt(user_question, all_sources)
 
-        ## Implications & Future Considerations
-        (Discuss broader significance, potential consequences, and areas needing further research based on the findings.)
+        # Repeat syntheses over the same source set skip the LLM entirely;
+        # the fuzzy tier also catches the question asked in other words.
+        # Hashing the sorted links into the namespace scopes fuzzy matches
+        # to identical source sets.
+        links = ",".join(sorted((s.get('link') or s.get('url') or s.get('title') or '') for s in all_sources))
+        cache_ns = f"deep_synthesis:{self.model}:{hashlib.sha256(links.encode()).hexdigest()}"
+        cached = llm_cache.get(cache_ns, user_question.strip().lower(), fuzzy_text=user_question)
+        if cached is not None:
+            return cached
 
-        ## Conclusion
-        (Synthesize main points into a definitive answer to the original question. Highlight the most important takeaways and their significance.)
+        try:
+            if "gemini" in self.model.lower():
+                response = self._call_with_retry(lambda: self.client.models.generate_content(
+                    model=self.model,
+                    contents=prompt,
+                    config=self._gemini_config()
+                ))
+                report_text = response.text.strip() if response.text is not None else ""
+            else:
+                response = self._call_with_retry(lambda: self.client.generate(
+                    model=self.model,
+                    prompt=prompt,
+                    system=_DEEP_SYNTHESIS_INSTRUCTIONS
+                ))
+                report_text = response['response'] if response['response'] is not None else ""
+            report = report_text + source_list_html
+            llm_cache.put(cache_ns, user_question.strip().lower(), report, fuzzy_text=user_question)
+            return report
+        except LLMOverloadedError:
+            # Saturation must reach the route's 503 handler; an error
+            # string here would ship it to the client as a 200.
+            raise
+        except Exception as e:
+            return f"Error during synthesis: {e}"
 
-        **IMPORTANT NOTES:**
-        - Do NOT add a "Sources" or "References" section - this will be appended automatically
-        - Your response should end with the Conclusion section
-        - Aim for thoroughness while maintaining readability
-        - If the sources don't adequately address the original question, acknowledge this limitation
+    def synthesize_stream(self, user_question: str, all_sources: List[Dict[str, Any]]) -> Iterator[str]:
+        """
+        Yield the report as token chunks instead of buffering the full answer.
 
-        **Original User Question:** "{user_question}"
+        Deep reports are long, so the gap between first token and full
+        report is largest here; streaming means the caller sees the
+        executive summary while the rest is still being generated. The
+        HTML source list is yielded last, after the report text.
+        """
+        if not all_sources:
+            yield "No relevant sources were found to answer your question."
+            return
 
-        **Research Sources:**
-        {context}
+        prompt, source_list_html = self._build_prompt(user_question, all_sources)
 
-        Produce a comprehensive, analytical report following the structure above.
-        """
-        
         try:
-            response = self.client.models.generate_content(
-                model=self.model, 
-                contents=prompt
-            )
-            report_text = response.text.strip() if response.text is not None else ""
-            return report_text + source_list_html
+            if "gemini" in self.model.lower():
+                for chunk in self._stream_with_gate(lambda: self.client.models.generate_content_stream(
+                    model=self.model,
+                    contents=prompt,
+                    config=self._gemini_config()
+                )):
+                    if chunk.text:
+                        yield chunk.text
+            else:
+                for part in self._stream_with_gate(lambda: self.client.generate(
+                    model=self.model,
+                    prompt=prompt,
+                    system=_DEEP_SYNTHESIS_INSTRUCTIONS,
+                    stream=True
+                )):
+                    if part.get('response'):
+                        yield part['response']
+            yield source_list_html
+        except LLMOverloadedError:
+            raise
         except Exception as e:
-            return f"Error during synthesis: {e}"
\ No newline at end of file
+            yield f"Error during synthesis: {e}"
\ No newline at end of file
@@ -7,6 +7,7 @@ import os
 import sys
 from planner_agent import PlannerAgent
 from planner_agent_deep_research import PlannerAgentDeepResearch
+from llm_replay import attach
 
 def test_both_modes():
     """Test both research modes with a simple query."""
@@ -22,8 +23,9 @@ def test_both_modes():
     try:
         # Initialize both planners
         print("🔧 Initializing Planner Agents...")
-        planner_deep_search = PlannerAgent()
-        planner_deep_research = PlannerAgentDeepResearch()
+        planner_deep_search = attach(PlannerAgent(), "analyze_query")
+        planner_deep_research = attach(PlannerAgentDeepResearch(), "analyze_query")
+        attach(planner_deep_research.decomposition_agent, "decompose_question")
         print("✅ Both Planner Agents initialized successfully")
         
         # Test query analysis
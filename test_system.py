@@ -6,6 +6,7 @@ Test script for the Multi-Agent Research System
 import os
 import sys
 from planner_agent import PlannerAgent
+from llm_replay import attach
 
 def test_planner_agent():
     """Test the planner agent with a simple query."""
@@ -21,7 +22,7 @@ def test_planner_agent():
     try:
         # Initialize planner agent
         print("🔧 Initializing Planner Agent...")
-        planner = PlannerAgent()
+        planner = attach(PlannerAgent(), "analyze_query")
         print("✅ Planner Agent initialized successfully")
         
         # Test query analysis
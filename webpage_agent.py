@@ -1,8 +1,48 @@
 import asyncio
+import hashlib
+import re
 from typing import Dict, List, Any, Optional, Union
 
-from base_agent import BaseAgent
+from base_agent import AgentResult, BaseAgent, run_coroutine
 from synthesizer_agent_deep_research import SynthesizerAgentDeepResearch
+from ttl_cache import TTLCache
+
+# Two-tier cache for repeat submissions of the same URL (common in demos
+# and iterative sessions). The fetch tier keyed by URL holds the extracted
+# text, skipping the crawl; the summary tier keyed by the content hash and
+# question also skips the LLM summarization when nothing changed.
+_FETCH_CACHE = TTLCache(maxsize=256, ttl=3600)
+_SUMMARY_CACHE = TTLCache(maxsize=256, ttl=3600)
+
+# Crawl-result attributes that may carry the page text, best first
+_CONTENT_ATTRS = ("markdown_v2", "markdown", "extracted_text", "cleaned_html", "html", "raw_html")
+
+# Cap on extracted page text; anything past this is almost always nav,
+# footers or comment threads, and every surplus char costs LLM tokens.
+_MAX_CONTENT_CHARS = 12000
+
+# Cheap boilerplate patterns, compiled once: markdown lines that are only
+# a link (nav menus), long lines with no letters (separators, encoded
+# blobs), and runs of blank lines left behind by the stripping.
+_LINK_ONLY_LINE_RE = re.compile(r'^\s*\[[^\]]+\]\([^)]+\)\s*$', re.M)
+_NO_LETTER_LINE_RE = re.compile(r'^[^A-Za-z\n]{80,}$', re.M)
+_BLANK_RUNS_RE = re.compile(r'\n{3,}')
+
+
+def _strip_boilerplate(text: str) -> str:
+    """Drop obvious markdown boilerplate and collapse the gaps it leaves."""
+    text = _LINK_ONLY_LINE_RE.sub('', text)
+    text = _NO_LETTER_LINE_RE.sub('', text)
+    return _BLANK_RUNS_RE.sub('\n\n', text).strip()
+
+
+def _content_fingerprint(sources: List[Dict[str, Any]]) -> str:
+    """Stable hash of the extracted page text, so a re-crawled page with
+    identical content still hits the summary cache."""
+    digest = hashlib.sha256()
+    for source in sources:
+        digest.update((source.get('content') or '').encode('utf-8', 'replace'))
+    return digest.hexdigest()
 
 
 class WebpageAgent(BaseAgent):
@@ -34,9 +74,11 @@ class WebpageAgent(BaseAgent):
             url = query
 
         if url:
-            return [self._fetch_one(url)]
+            return self._fetch_many([url])
         if urls:
-            return [self._fetch_one(u) for u in urls if isinstance(u, str) and u.startswith(("http://", "https://"))]
+            return self._fetch_many(
+                [u for u in urls if isinstance(u, str) and u.startswith(("http://", "https://"))]
+            )
 
         # Nothing to do
         return []
@@ -46,7 +88,7 @@ class WebpageAgent(BaseAgent):
         return sources
 
     # Public API ----------------------------------------------------------------
-    def run(self, user_question: str, **kwargs) -> Dict[str, Any]:
+    def run(self, user_question: str, **kwargs) -> AgentResult:
         """
         Crawl the provided URL(s) and synthesize with the given user question.
 
@@ -64,81 +106,105 @@ class WebpageAgent(BaseAgent):
         sources = self.search(url or "", url=url, urls=urls)
 
         if not sources:
-            return {
-                "agent": self.name,
-                "sources": [],
-                "result": "No webpage content could be fetched for the provided URL(s).",
-            }
-
-        # Synthesize final report using webpage sources
-        final_report = self.synthesizer_agent.synthesize(user_question, sources)
-
-        return {
-            "agent": self.name,
-            "sources": sources,
-            "result": final_report,
-        }
+            return AgentResult(
+                summary="No webpage content could be fetched for the provided URL(s).",
+                sources=[],
+            )
+
+        # Synthesize final report using webpage sources, unless the same
+        # question was already answered over identical page content
+        summary_key = (self.model, user_question.strip().lower(), _content_fingerprint(sources))
+        final_report = _SUMMARY_CACHE.get(summary_key)
+        if final_report is None:
+            final_report = self.synthesizer_agent.synthesize(user_question, sources)
+            _SUMMARY_CACHE.set(summary_key, final_report)
+
+        return AgentResult(summary=final_report, sources=sources)
 
     # Internal helpers ----------------------------------------------------------
-    def _fetch_one(self, url: str) -> Dict[str, Any]:
+    def _fetch_many(self, urls: List[str]) -> List[Dict[str, Any]]:
+        """
+        Fetch URLs via crawl4ai, crawling the cache misses concurrently.
+
+        One crawler context and one event loop serve the whole batch, so
+        N uncached URLs cost max-of-latencies plus a single crawler
+        bootstrap instead of N serial round-trips and N startups.
         """
-        Fetch a single URL via crawl4ai and normalize the output into a source dict.
+        if not urls:
+            return []
+
+        sources: List[Optional[Dict[str, Any]]] = []
+        miss_indices: List[int] = []
+        for idx, url in enumerate(urls):
+            cached = _FETCH_CACHE.get(url)
+            sources.append(dict(cached) if cached is not None else None)
+            if cached is None:
+                miss_indices.append(idx)
+
+        if miss_indices:
+            try:
+                from crawl4ai import AsyncWebCrawler  # type: ignore
+            except Exception as e:
+                for idx in miss_indices:
+                    sources[idx] = {
+                        "title": urls[idx],
+                        "content": f"crawl4ai not available: {e}",
+                        "link": urls[idx],
+                        "source_type": "webpage",
+                    }
+                return [s for s in sources if s is not None]
+
+            miss_urls = [urls[idx] for idx in miss_indices]
+
+            async def _crawl_all():
+                async with AsyncWebCrawler() as crawler:
+                    return await asyncio.gather(
+                        *(crawler.arun(url=u) for u in miss_urls),
+                        return_exceptions=True,
+                    )
+
+            results = self._run_coroutine(_crawl_all) or [None] * len(miss_urls)
+            for idx, result in zip(miss_indices, results):
+                sources[idx] = self._normalize(result, urls[idx])
+
+        return [s for s in sources if s is not None]
+
+    @staticmethod
+    def _run_coroutine(coro_factory):
+        """Run a coroutine to completion robustly across environments.
+
+        The loop check happens up front: no running loop means a plain
+        asyncio.run (the crawler is created per batch, so nothing here is
+        bound to the short-lived loop); otherwise (e.g., notebooks) the
+        work is dispatched to the shared background loop instead of paying
+        thread + event-loop creation on every call.
         """
         try:
-            from crawl4ai import AsyncWebCrawler  # type: ignore
-        except Exception as e:
-            return {
-                "title": url,
-                "content": f"crawl4ai not available: {e}",
-                "link": url,
-                "source_type": "webpage",
-            }
-
-        async def _fetch(url: str):
-            async with AsyncWebCrawler() as crawler:
-                return await crawler.arun(url=url)
-
-        # Run the coroutine robustly across environments
-        try:
-            result = asyncio.run(_fetch(url))
+            asyncio.get_running_loop()
         except RuntimeError:
-            # Fall back if an event loop is already running (e.g., notebooks)
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                import threading
-
-                container: Dict[str, Any] = {}
-
-                def runner():
-                    new_loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(new_loop)
-                    try:
-                        container["value"] = new_loop.run_until_complete(_fetch(url))
-                    finally:
-                        new_loop.close()
-
-                t = threading.Thread(target=runner)
-                t.start()
-                t.join()
-                result = container.get("value")
-            else:
-                result = loop.run_until_complete(_fetch(url))
-
-        # Extract best-available text/markdown
+            return asyncio.run(coro_factory())
+        return run_coroutine(coro_factory())
+
+    def _normalize(self, result: Any, url: str) -> Dict[str, Any]:
+        """Normalize one crawl result (or failure) into a source dict."""
+        if result is None or isinstance(result, BaseException):
+            result = None
+
+        # Extract best-available text/markdown. The instance __dict__ gives
+        # a plain dict lookup per attribute; getattr with a default covers
+        # slotted/property-backed results without hasattr's try/except cost.
         content = None
-        for attr in (
-            "markdown_v2",
-            "markdown",
-            "extracted_text",
-            "cleaned_html",
-            "html",
-            "raw_html",
-        ):
-            if hasattr(result, attr):
-                val = getattr(result, attr)
-                if val:
-                    content = val
-                    break
+        result_vars = getattr(result, "__dict__", None) or {}
+        for attr in _CONTENT_ATTRS:
+            val = result_vars.get(attr) or getattr(result, attr, None)
+            if val:
+                content = val
+                break
+
+        if content:
+            # Trim boilerplate and cap size before the text is cached and
+            # tokenized downstream; raw page dumps can run to megabytes.
+            content = _strip_boilerplate(str(content))[:_MAX_CONTENT_CHARS]
 
         # Extract title from metadata when available
         title = None
@@ -154,9 +220,13 @@ class WebpageAgent(BaseAgent):
         if not content:
             content = f"No readable content extracted from: {url}"
 
-        return {
+        source = {
             "title": title,
             "content": content,
             "link": url,
             "source_type": "webpage",
         }
+        # Cache only real extractions; failures should retry next time
+        if not content.startswith("No readable content extracted"):
+            _FETCH_CACHE.set(url, dict(source))
+        return source
@@ -1,8 +1,22 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
 from googleapiclient.discovery import build
 from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
 from base_agent import BaseAgent
+from ttl_cache import TTLCache
+
+# Search results and transcripts are stable for hours, and neighboring
+# sub-questions frequently repeat queries; caching skips the API quota
+# and network round-trip on repeats.
+_SEARCH_CACHE = TTLCache(maxsize=512, ttl=6 * 3600)
+_TRANSCRIPT_CACHE = TTLCache(maxsize=1024, ttl=6 * 3600)
+
+# Long-lived pool for transcript fetches, so search() can kick them off
+# the moment videoIds are known instead of waiting for a separate
+# process_sources pass to spin up workers.
+_TRANSCRIPT_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="yt-transcript")
 
 
 class YoutubeAgent(BaseAgent):
@@ -13,13 +27,33 @@ class YoutubeAgent(BaseAgent):
         self.youtube_api_key = os.getenv("GOOGLE_API_KEY")
         if not self.youtube_api_key:
             raise ValueError("YouTube API key not found")
-    
+        # One API client per thread: building it re-parses the discovery
+        # document and opens a fresh TLS connection, and the underlying
+        # httplib2 transport is not safe to share across threads.
+        self._local = threading.local()
+
+    def _get_youtube(self):
+        youtube = getattr(self._local, "youtube", None)
+        if youtube is None:
+            youtube = build("youtube", "v3", developerKey=self.youtube_api_key,
+                            cache_discovery=False, static_discovery=True)
+            self._local.youtube = youtube
+        return youtube
+
     def search(self, query: str, **kwargs) -> List[Dict[str, Any]]:
         """Search YouTube for videos."""
         max_results = kwargs.get('max_results', 5)
-        
-        youtube = build("youtube", "v3", developerKey=self.youtube_api_key)
-        
+
+        cache_key = (query.lower().strip(), max_results)
+        cached = _SEARCH_CACHE.get(cache_key)
+        if cached is not None:
+            # Copies, since process_sources annotates the dicts in place
+            videos = [dict(video) for video in cached]
+            self._submit_transcripts(videos, kwargs.get('transcript_limit', 3000))
+            return videos
+
+        youtube = self._get_youtube()
+
         try:
             request = youtube.search().list(
                 q=query,
@@ -41,22 +75,51 @@ class YoutubeAgent(BaseAgent):
                     "url": f"https://www.youtube.com/watch?v={item['id']['videoId']}",
                     "source_type": "youtube"
                 })
+            if videos:
+                _SEARCH_CACHE.set(cache_key, [dict(video) for video in videos])
+            self._submit_transcripts(videos, kwargs.get('transcript_limit', 3000))
             return videos
         except Exception as e:
             print(f"YouTube search error: {e}")
             return []
     
+    def _submit_transcripts(self, videos: List[Dict[str, Any]], char_limit: int) -> None:
+        """Start transcript fetches for a batch of search results.
+
+        Fusing the fetch start into search() lets the downloads overlap
+        whatever the caller does between the search and processing stages;
+        process_sources only has to collect the results.
+        """
+        for video in videos:
+            video['_transcript_future'] = _TRANSCRIPT_POOL.submit(
+                self._fetch_transcript, video['videoId'], char_limit
+            )
+
     def process_sources(self, sources: List[Dict[str, Any]], **kwargs) -> List[Dict[str, Any]]:
-        """Process YouTube sources by fetching transcripts."""
+        """Attach transcripts to YouTube sources, collecting in-flight fetches.
+
+        Sources coming from search() already carry transcript futures;
+        anything else is submitted here so the batch still overlaps its
+        round-trips. Failures stay inside _fetch_transcript (returns None).
+        """
         char_limit = kwargs.get('transcript_limit', 3000)
-        
-        for video in sources:
-            video['transcript'] = self._fetch_transcript(video['videoId'], char_limit)
-        
+
+        futures = [
+            video.pop('_transcript_future', None)
+            or _TRANSCRIPT_POOL.submit(self._fetch_transcript, video['videoId'], char_limit)
+            for video in sources
+        ]
+        for video, future in zip(sources, futures):
+            video['transcript'] = future.result()
+
         return sources
     
     def _fetch_transcript(self, video_id: str, char_limit: int = 3000) -> Optional[str]:
         """Fetch transcript for a video."""
+        cache_key = (video_id, char_limit)
+        cached = _TRANSCRIPT_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
         try:
             transcript_list = YouTubeTranscriptApi().fetch(video_id, languages=['en'])
             texts = [seg.text.strip() for seg in transcript_list if hasattr(seg, 'text') and seg.text]
@@ -64,6 +127,7 @@ class YoutubeAgent(BaseAgent):
             
             if len(joined) > char_limit:
                 joined = joined[:char_limit] + "..."
+            _TRANSCRIPT_CACHE.set(cache_key, joined)
             return joined
         except (TranscriptsDisabled, NoTranscriptFound):
             return None